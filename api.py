@@ -18,37 +18,112 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from urllib import error, parse, request
-from sys import exit
-from bexceptions import NoCaseInList, PageNotFound, MultipleCases
+from urllib import error, parse
+from http import client
+from bexceptions import NoCaseInList, PageNotFound, MultipleCases, RequestFailed
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+import gzip
 import json
+import logging
+import multiprocessing
+import random
 import re
 import os
+import sqlite3
+import string
+import threading
+import time
+import zlib
 
 
 class API(object):
-    """Makes any calls to the Wikisource API to retrieve necessary information."""
+    """Makes any calls to the Wikisource API to retrieve necessary information. Connections to the
+    API are kept open between calls, so a single API object should be reused for a whole run.
 
-    def __init__(self):
-        self.base_URL = 'http://en.wikisource.org/w/api.php?format=json&action='
-        self.base_volume = 'United States Reports/Volume '
-        self.cache = Cache()
+    Requests that time out, can't reach the server, or get a 429 or 5xx response are retried up to
+    retries times, waiting as long as the Retry-After header asks or else backing off
+    exponentially from backoff seconds. If a limiter (a TokenBucket) is given, every request waits
+    for a token from it first."""
 
-    def case_exists(self, line):
-        """Use the Wikisource API to parse the case line and determine if the case already exists
-        on Wikisource."""
+    # The API accepts up to 50 titles in a single query
+    max_titles = 50
+    # Volume lists are large, so fewer are asked for at once to stay under the response size limit
+    max_volumes = 10
+    # Responses that are worth trying again
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_URL='https://en.wikisource.org/w/api.php?format=json&action=',
+                 pool_size=4, cache_ttl=86400, cache_backend='files', timeout=60, retries=5,
+                 backoff=1, max_delay=120, limiter=None):
+        self.base_URL = base_URL
+        self.base_volume = 'United States Reports/Volume '
+        self.cache = CACHE_BACKENDS[cache_backend](ttl=cache_ttl)
+        self.pool = ConnectionPool(pool_size, timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.limiter = limiter
+        self.existing = dict()  # Case title -> whether the page exists on Wikisource
+        self.pending = set()  # Case titles from the volume lists that haven't been checked yet
 
-        title = None
+    @staticmethod
+    def case_title(line):
+        """Get the title of the case linked from a line in a volume list."""
         # Avoid determining if category exists; this will return a false positive.
-        title_match = re.search(r'\[{2}(?!:?Category)(?P<link>.*?)\]{2}', line)
+        title_match = VolumeIndex.link.search(line)
         if title_match:
-            title = title_match.group("link")
+            return title_match.group("title").strip()
+        return None
+
+    def case_exists(self, line):
+        """Determine whether the case in the line already exists on Wikisource. The first time
+        this is called, every case title collected from the volume lists loaded so far is checked
+        along with it, so the rest of the cases in those volumes don't need a request of their
+        own."""
+        title = self.case_title(line)
+        if not title:
+            return None
+        if title not in self.existing:
+            self.pending.add(title)
+            self.check_titles(self.pending)
+        return self.existing.get(title)
+
+    def check_titles(self, titles):
+        """Look up whether each of the pages exists, using as few queries as possible. The results
+        are kept in self.existing."""
+        titles = self.unchecked_titles(titles)
+        for i in range(0, len(titles), self.max_titles):
+            self.record_existence(self.query_existence(titles[i:i + self.max_titles]))
+        self.pending.difference_update(titles)
 
-        url = self.base_URL + 'parse&text={0}&prop=links'.format(parse.quote(line))
+    def unchecked_titles(self, titles):
+        """The titles whose existence isn't known yet, either from this run or from the cache."""
+        titles = set(titles).difference(self.existing)
+        self.existing.update(self.cache.get_existing(titles))
+        return sorted(titles.difference(self.existing))
+
+    def query_existence(self, titles):
+        """Ask the API whether each of up to max_titles pages exists. Returns a dict of title ->
+        whether the page exists, and doesn't change any state, so it is safe to call from several
+        threads at once."""
+        url = self.base_URL + 'query&titles={0}'.format(parse.quote('|'.join(titles)))
         response = self.request(url)
-        for link in response["parse"]["links"]:
-            if link['*'] == title:
-                return "exists" in link
+        # The API returns titles in normalized form; map them back to the ones we asked for. Several
+        # of those may normalize to the same page.
+        names = dict((title, [title]) for title in titles)
+        for item in response["query"].get("normalized", []):
+            names.setdefault(item["to"], []).append(item["from"])
+        existing = dict((title, False) for title in titles)
+        for page in response["query"]["pages"].values():
+            for title in names.get(page["title"], [page["title"]]):
+                existing[title] = "missing" not in page and "invalid" not in page
+        return existing
+
+    def record_existence(self, existing):
+        """Keep the results of query_existence(), in memory and in the cache."""
+        self.existing.update(existing)
+        self.cache.set_existing(existing)
 
     def get_case_line(self, title, vol, page):
         """Find the case in the appropriate U.S. Reports list. Follows the following logic:
@@ -58,30 +133,26 @@ class API(object):
             - Else search for the a line matching the exact case name in the list
                 - Return line if only one is found
                 - Raise MultipleCases if multiple matches are found
-           If neither of these returns a result, raise NoCaseInList
+            - Else search for the line sharing the most words with the petitioner and respondent
+           If none of these returns a result, raise NoCaseInList
         """
 
         # Get the appropriate United States Reports/Volume page
         volume = parse.quote(self.base_volume + vol)
-        url = self.base_URL + 'query&titles={0}&prop=revisions&rvprop=content'.format(volume)
-        content = self.cache.get_cached_volume(vol)
-        if not content:
-            response = self.request(url)
-            rev_id = list(response["query"]["pages"].keys())[0]
-            if rev_id == "-1":
-                raise PageNotFound("There is no Wikisource page at {}.".format(volume))
-            content = response["query"]["pages"][rev_id]["revisions"][0]["*"]
-            self.cache.add_to_volume_cache(vol, content)
+        url = self.base_URL + 'query&titles={0}&prop=revisions&rvprop=content|ids'.format(volume)
+        index = self.load_volume(vol, url)
+        self.pending.update(title for title in index.links if title and title not in self.existing)
+        miss = self.cache.get_miss(vol, page, title, index.revid)
+        if miss:
+            raise NoCaseInList(miss)
 
         # Search this page for "[volume] U.S. [page]"
-        rstring = "^.*?\D{0}\sU\.S\.\s{1}\D.*?$".format(vol, page)
-        regex = re.compile(rstring, re.MULTILINE)
-        match = regex.findall(content)
+        match = index.by_citation(vol, page)
         if match:
             if len(match) == 1:
                 return match[0]
             else:
-                result = self.filter_multiple(title, match)
+                result = index.by_parties(title, vol, page)
                 if result:
                     return result
                 else:
@@ -89,87 +160,692 @@ class API(object):
                                         " {2}) in API query: {3}".format(title, vol, page, url))
         # Search this page for the exact title (case-insensitive)
         else:
-            regex = re.compile(re.escape(title), re.MULTILINE | re.IGNORECASE)
-            match = regex.findall(content)
+            match = index.by_title(title)
             if match:
                 if len(match) == 1:
                     return match[0]
                 else:
                     # VERY unlikely to happen, but no harm in adding it
                     raise MultipleCases("Unable to resolve multiple NAME matches for {0} ({1} U.S."
-                                        " {2}) in API query: {2}".format(title, vol, page, url))
-            # Neither method worked; time to give up.
+                                        " {2}) in API query: {3}".format(title, vol, page, url))
+            # Neither method worked; try matching the words of the parties before giving up.
             else:
-                raise NoCaseInList("Unable to find case {0} ({1} U.S. {2}) in the list of cases"
-                                   " retrieved from API query: {3}.".format(title, vol, page, url))
+                match = index.by_sides(title, vol, page)
+                if match:
+                    logging.getLogger('brandeis').warning(
+                        "Matched {0} ({1} U.S. {2}) to \"{3}\" by the names of the parties only. "
+                        "Please check that this is the same case.".format(title, vol, page,
+                                                                          match.strip()))
+                    return match
+                message = ("Unable to find case {0} ({1} U.S. {2}) in the list of cases retrieved"
+                           " from API query: {3}.".format(title, vol, page, url))
+                self.cache.add_miss(vol, page, title, index.revid, message)
+                raise NoCaseInList(message)
+
+    def load_volume(self, vol, url):
+        """Get the index of a volume list. A cached copy is used as long as it is younger than the
+        cache TTL; after that, only the latest revision ID is requested, and the list itself is
+        downloaded again only if the page has been edited since it was cached."""
+        index = self.cache.get_volume_index(vol)
+        if index is not None:
+            if self.cache.is_fresh(index):
+                return index
+            if index.revid is not None and self.latest_revision(vol) == index.revid:
+                return self.cache.touch(vol, index)
+        response = self.request(url)
+        rev_id = list(response["query"]["pages"].keys())[0]
+        if rev_id == "-1":
+            raise PageNotFound("There is no Wikisource page at {}.".format(
+                parse.quote(self.base_volume + vol)))
+        revision = response["query"]["pages"][rev_id]["revisions"][0]
+        return self.cache.add_to_volume_cache(vol, revision["*"], revision.get("revid"))
+
+    def latest_revision(self, vol):
+        """The ID of the latest revision of a volume list, or None if the page doesn't exist."""
+        url = self.base_URL + 'query&titles={0}&prop=revisions&rvprop=ids'.format(
+            parse.quote(self.base_volume + vol))
+        for page in self.request(url)["query"]["pages"].values():
+            if "revisions" in page:
+                return page["revisions"][0]["revid"]
+        return None
+
+    def prefetch_volumes(self, volumes):
+        """Make sure the volume lists are cached and up to date, so converting cases from them
+        never has to wait on the network. Stale volumes are checked by revision ID and missing or
+        edited ones are downloaded, several per query. Returns the volumes with no page on
+        Wikisource."""
+        fetch, stale = self.plan_volumes(volumes)
+        fetch += self.refresh_volumes(stale, self.query_volumes(stale, 'ids'))
+        return self.store_volumes(self.query_volumes(fetch, 'content|ids'))
+
+    def plan_volumes(self, volumes):
+        """Sort out which volume lists have to be downloaded, and which are cached but have to be
+        checked for a new revision. Returns the list of volumes to download and a dict of stale
+        volume -> cached index."""
+        fetch = []
+        stale = dict()
+        for vol in volumes:
+            index = self.cache.get_volume_index(vol)
+            if index is None or index.revid is None:
+                fetch.append(vol)
+            elif not self.cache.is_fresh(index):
+                stale[vol] = index
+        return fetch, stale
+
+    def refresh_volumes(self, stale, revisions):
+        """Mark the stale volumes that haven't been edited as fresh. Returns the ones that have to
+        be downloaded again."""
+        fetch = []
+        for vol, revision in revisions.items():
+            if revision and revision["revid"] == stale[vol].revid:
+                self.cache.touch(vol, stale[vol])
+            else:
+                fetch.append(vol)
+        return fetch
+
+    def store_volumes(self, revisions):
+        """Cache the downloaded volume lists. Returns the volumes with no page on Wikisource."""
+        missing = []
+        for vol, revision in revisions.items():
+            if revision is None:
+                missing.append(vol)
+            else:
+                self.cache.add_to_volume_cache(vol, revision["*"], revision["revid"])
+        return sorted(missing, key=int)
+
+    def query_volumes(self, volumes, rvprop):
+        """Get the latest revision of each of the volume lists, max_volumes per query. Returns a
+        dict of volume -> revision, or None if the volume has no page. Like query_existence(), this
+        doesn't change any state."""
+        queue = list(volumes)
+        revisions = dict()
+        while queue:
+            batch, queue = queue[:self.max_volumes], queue[self.max_volumes:]
+            titles = parse.quote('|'.join(self.base_volume + vol for vol in batch))
+            url = self.base_URL + 'query&titles={0}&prop=revisions&rvprop={1}'
+            for page in self.request(url.format(titles, rvprop))["query"]["pages"].values():
+                vol = page["title"][len(self.base_volume):]
+                if "missing" in page or "invalid" in page:
+                    revisions[vol] = None
+                elif "revisions" in page:
+                    revisions[vol] = page["revisions"][0]
+            # Pages left out because the response grew too large are asked for again.
+            left_out = [vol for vol in batch if vol not in revisions]
+            if len(left_out) < len(batch):
+                queue.extend(left_out)
+            else:
+                revisions.update((vol, None) for vol in left_out)
+        return revisions
 
     @staticmethod
     def filter_multiple(title, match_list):
         """Fuzzy-matches the case name in a list of possible matches. Occasionally the volume page
         will have multiple cases with the same volume and page numbers; this will try to match by
         title. Titles may not be exact, so this requires one word in the petitioner and one in the
-        respondent matches. Common words ("the", "et", "al", etc.) will not be matched.
-        
+        respondent matches. Common words ("the", "et", "al", etc.) will not be matched. See
+        VolumeIndex.by_parties().
+
         This does NOT correct for spelling mistakes. This does NOT try to differentiate between two
         cases that have matching words in the petitioner and title (for example, it will not return
         a result for "Respublica v. Sweers" when the match list includes "Respublica v. Sweers" and
         "Respublica v. Cornelius Sweers"."""
-        try:
-            petitioner, respondent = title.split('v.')
-            petitioner = set([item.strip().lower() for item in petitioner.split()])
-            respondent = set([item.strip().lower() for item in respondent.split()])
-            common_words = {"the", "et", "al", "et.", "al.", "of", "a", "for", "and", "inc.", "no.",
-                            "&", "co.", "ltd.", "l.l.c."}
-            petitioner = list(petitioner.difference(common_words))
-            respondent = list(respondent.difference(common_words))
-        except:
-            return None
-        else:
-            actual_matches = []
-            for item in match_list:
-                if any(word in item.lower() for word in petitioner) and any(word in item.lower()
-                                                                            for word in respondent):
-                    actual_matches.append(item)
-            if len(actual_matches) == 1:
-                return actual_matches[0]
-            else:
-                return None
+        return VolumeIndex('\n'.join(match_list)).by_parties(title)
+
+    def request(self, url):
+        """Generic API request function. Requires that the response format be JSON. Raises
+        RequestFailed if the request can't be completed, even after retrying."""
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                return json.loads(self.pool.get(url).decode('utf-8'))
+            except error.HTTPError as e:
+                if e.code not in self.retry_statuses:
+                    raise RequestFailed("HTTP error {0} from API query: {1}".format(e.code, url))
+                problem = "HTTP error {0}".format(e.code)
+                delay = self.retry_after(e.headers)
+            except error.URLError as e:
+                problem = "{0}".format(e.reason)
+                delay = None
+            except ValueError:
+                # A truncated or garbled body, which a fresh request will likely get right
+                problem = "Invalid response"
+                delay = None
+            if attempt == self.retries:
+                break
+            if delay is None:
+                # Exponential backoff, with jitter so parallel workers don't retry in lockstep
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1)
+            delay = min(delay, self.max_delay)
+            logging.getLogger('brandeis').warning("{0} from API query: {1}. Retrying in {2:.1f} "
+                                                  "seconds.".format(problem, url, delay))
+            time.sleep(delay)
+        raise RequestFailed("{0} from API query: {1}. Gave up after {2} retries."
+                            .format(problem, url, self.retries))
 
     @staticmethod
-    def request(url):
-        """Generic API request function. Requires that the response format be JSON."""
+    def retry_after(headers):
+        """The number of seconds a Retry-After header asks to wait, or None if there is no valid
+        header. The header can be a number of seconds or an HTTP date."""
+        value = headers.get('Retry-After') if headers else None
+        if not value:
+            return None
         try:
-            response = json.loads(request.urlopen(url).read().decode('utf-8'))
-        except error.HTTPError:
-            exit("Exited: HTTPError when making API requests.")
+            return max(0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket(object):
+    """
+    Limits requests to rate per second on average, allowing bursts of up to burst requests. The
+    bucket lives in shared memory, so one bucket passed to worker processes limits all of them
+    together.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        # Tokens available, and when they were last counted
+        self.state = multiprocessing.Array('d', [self.burst, time.time()])
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            with self.state.get_lock():
+                now = time.time()
+                tokens = min(self.burst, self.state[0] + (now - self.state[1]) * self.rate)
+                if tokens >= 1:
+                    self.state[0], self.state[1] = tokens - 1, now
+                    return
+                self.state[0], self.state[1] = tokens, now
+            time.sleep((1 - tokens) / self.rate)
+
+
+class ConnectionPool(object):
+    """Keeps HTTP connections open between requests, so each call to the API doesn't pay for a new
+    TCP and TLS handshake. Up to size idle connections are kept for each host. Responses are
+    requested gzip-compressed."""
+
+    headers = {'Accept-Encoding': 'gzip', 'Connection': 'keep-alive',
+               'User-Agent': 'BrandeisBot (https://en.wikisource.org/wiki/User:BrandeisBot)'}
+    # Errors that mean the server closed an idle connection, so the request can be sent again on a
+    # new one. Anything else, such as a timeout, is reported to the caller.
+    stale_errors = (client.BadStatusLine, BrokenPipeError, ConnectionAbortedError,
+                    ConnectionResetError)
+
+    def __init__(self, size=4, timeout=60):
+        self.size = size
+        self.timeout = timeout
+        self.idle = dict()
+        self.lock = threading.Lock()
+
+    def get(self, url, redirects=5):
+        """Make a GET request and return the body of the response. Raises HTTPError for error
+        responses and URLError if the server can't be reached, like urlopen(), and ValueError if a
+        compressed body can't be decompressed."""
+        parts = parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        while True:
+            connection, reused = self.acquire(key)
+            try:
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (client.HTTPException, OSError) as e:
+                connection.close()
+                if reused and isinstance(e, self.stale_errors):
+                    # The server closed an idle connection; the others are likely stale as well.
+                    self.clear(key)
+                    continue
+                raise error.URLError(e)
+            break
+        if response.will_close:
+            connection.close()
         else:
-            return response
+            self.release(key, connection)
+        if response.status in (301, 302, 303, 307, 308) and redirects:
+            return self.get(parse.urljoin(url, response.getheader('Location')), redirects - 1)
+        if response.status >= 400:
+            raise error.HTTPError(url, response.status, response.reason, response.headers, None)
+        if response.getheader('Content-Encoding') == 'gzip':
+            try:
+                body = gzip.decompress(body)
+            except (EOFError, OSError, zlib.error) as e:
+                raise ValueError("Could not decompress the response: {0}".format(e))
+        return body
+
+    def acquire(self, key):
+        """Get an idle connection to the host, or open a new one. Returns the connection and
+        whether it has been used before."""
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host = key
+        if scheme == 'https':
+            return client.HTTPSConnection(host, timeout=self.timeout), False
+        return client.HTTPConnection(host, timeout=self.timeout), False
+
+    def release(self, key, connection):
+        """Keep a connection for the next request, unless the pool for that host is full."""
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self, key):
+        """Close all idle connections to the host."""
+        with self.lock:
+            idle = self.idle.pop(key, [])
+        for connection in idle:
+            connection.close()
 
 
 class Cache(object):
     """
-    This class represents a cache
+    This class represents a cache of volume lists. Volumes are stored on disk in cache/, and the
+    indexes of the most recently used ones are also kept in memory, up to max_size characters in
+    total. The text of a volume isn't kept in memory, since its index holds the same lines. Each
+    volume records the revision it was fetched at and when; after ttl seconds it has to be checked
+    against the latest revision again. A ttl of None means volumes never go stale.
     """
 
-    def __init__(self):
+    def __init__(self, max_size=20000000, ttl=86400):
         try:
             os.mkdir('cache')
         except (OSError, IOError):
             pass
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.memory = OrderedDict()  # (kind, volume) -> (value, size), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Summary of how well the in-memory cache is doing, for the logs. Each lookup of a volume
+        index counts once."""
+        return ("Volume cache: {0} hits, {1} misses, {2} entries ({3} characters) in memory."
+                .format(self.hits, self.misses, len(self.memory), self.size))
+
+    def recall(self, key):
+        """Get a value from memory, or None if it isn't there."""
+        entry = self.memory.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.memory.move_to_end(key)
+        return entry[0]
+
+    def remember(self, key, value, size):
+        """Keep a value in memory, evicting the least recently used values to stay under
+        max_size."""
+        if key in self.memory:
+            self.size -= self.memory.pop(key)[1]
+        if size > self.max_size:
+            return
+        self.memory[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            self.size -= self.memory.popitem(last=False)[1][1]
+
+    def is_fresh(self, index):
+        """Whether a volume was fetched or checked recently enough to be used as is."""
+        return self.ttl is None or time.time() - index.fetched < self.ttl
+
+    def touch(self, volume, index):
+        """Record that a cached volume is still the latest revision."""
+        index.fetched = time.time()
+        return self.write_index(volume, index)
+
+    def get_volume_index(self, volume):
+        """Retrieve the index of an already-cached volume, or None if the volume is not cached.
+        Volumes cached before indexes were stored are indexed now."""
+        index = self.recall(('index', volume))
+        if index is not None:
+            return index
+        data = None
+        try:
+            with open('cache/' + volume + '.json', encoding='utf-8') as index_file:
+                data = json.load(index_file)
+            index = VolumeIndex.from_dict(data)
+        except (OSError, IOError, ValueError):
+            pass
+        if index is None:
+            content = self.get_cached_volume(volume)
+            if content is None:
+                return None
+            index = self.write_index(volume, VolumeIndex.reindex(content, data))
+        self.remember(('index', volume), index, index.size())
+        return index
 
     @staticmethod
-    def get_cached_volume(volume):
-        """Retrieve an already-cached volume, or None if it does not exist."""
+    def write_index(volume, index):
+        """Save a volume index next to the volume text."""
+        temp_name = 'cache/{0}.json.{1}.tmp'.format(volume, os.getpid())
+        with open(temp_name, 'w', encoding='utf-8') as index_file:
+            json.dump(index.to_dict(), index_file)
+        os.replace(temp_name, 'cache/' + volume + '.json')
+        return index
+
+    def get_cached_volume(self, volume):
+        """Retrieve an already-cached volume, or None if it does not exist. It is only needed to
+        index the volume again, so it is read from disk each time."""
         try:
             with open('cache/' + volume, encoding='utf-8') as cache_file:
-                content = cache_file.read()
-                return content
+                return cache_file.read()
         except (OSError, IOError):
             return None
 
-    @staticmethod
-    def add_to_volume_cache(volume, content):
-        """Add a volume to the cache."""
-        with open('cache/' + volume, 'w', encoding='utf-8') as cache_file:
+    def add_to_volume_cache(self, volume, content, revid=None):
+        """Add a volume and its index to the cache, and return the index. The files are written
+        under a temporary name and then moved into place, so parallel workers never read a
+        half-written volume."""
+        temp_name = 'cache/{0}.{1}.tmp'.format(volume, os.getpid())
+        with open(temp_name, 'w', encoding='utf-8') as cache_file:
             cache_file.write(content)
-        return True
+        os.replace(temp_name, 'cache/' + volume)
+        index = VolumeIndex(content)
+        index.revid = revid
+        index.fetched = time.time()
+        index = self.write_index(volume, index)
+        self.remember(('index', volume), index, index.size())
+        return index
+
+    def get_existing(self, titles):
+        """Previously checked existence of case pages, as a dict of title -> whether it exists.
+        The file cache doesn't keep these, so they are checked once per run."""
+        return dict()
+
+    def set_existing(self, results):
+        """Remember whether each of the case pages exists."""
+        pass
+
+    def get_miss(self, volume, page, title, revid):
+        """The error message from a case that wasn't found in this revision of a volume list, or
+        None. The file cache doesn't keep these."""
+        return None
+
+    def add_miss(self, volume, page, title, revid, message):
+        """Remember that a case isn't in this revision of a volume list."""
+        pass
+
+
+class SQLiteCache(Cache):
+    """
+    Keeps the volume lists, the existence of case pages, and cases missing from the volume lists
+    in a single SQLite database, cache/cache.sqlite3. Each process opens its own connection, and
+    the database is in write-ahead logging mode, so parallel workers can read while another one
+    writes. Pages found to exist are trusted for the same ttl as volume lists. Missing pages are
+    not remembered, since a case may be uploaded at any time, so they are checked again each run.
+    """
+
+    filename = 'cache/cache.sqlite3'
+    schema = ("CREATE TABLE IF NOT EXISTS volumes (volume TEXT PRIMARY KEY, content TEXT, "
+              "revid INTEGER, fetched REAL, volume_index TEXT)",
+              "CREATE TABLE IF NOT EXISTS existing (title TEXT PRIMARY KEY, page_exists INTEGER, "
+              "checked REAL)",
+              "CREATE TABLE IF NOT EXISTS misses (volume TEXT, page TEXT, title TEXT, "
+              "revid INTEGER, message TEXT, PRIMARY KEY (volume, page, title))")
+    # SQLite allows at most 999 parameters in a query
+    max_parameters = 500
+
+    def __init__(self, max_size=20000000, ttl=86400):
+        Cache.__init__(self, max_size, ttl)
+        self.pid = None
+        self.db = None
+
+    @property
+    def connection(self):
+        """This process's connection to the database. Connections can't be shared with child
+        processes, so a new one is opened after a fork."""
+        if self.pid != os.getpid():
+            self.db = sqlite3.connect(self.filename, timeout=60)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            with self.db:
+                for statement in self.schema:
+                    self.db.execute(statement)
+            self.pid = os.getpid()
+        return self.db
+
+    def get_volume_index(self, volume):
+        index = self.recall(('index', volume))
+        if index is not None:
+            return index
+        row = self.connection.execute('SELECT volume_index FROM volumes WHERE volume = ?',
+                                      (volume,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        index = VolumeIndex.from_dict(data)
+        if index is None:
+            content = self.get_cached_volume(volume)
+            index = self.write_index(volume, VolumeIndex.reindex(content, data))
+        self.remember(('index', volume), index, index.size())
+        return index
+
+    def write_index(self, volume, index):
+        with self.connection:
+            self.connection.execute('UPDATE volumes SET volume_index = ?, revid = ?, fetched = ? '
+                                    'WHERE volume = ?', (json.dumps(index.to_dict()), index.revid,
+                                                         index.fetched, volume))
+        return index
+
+    def get_cached_volume(self, volume):
+        row = self.connection.execute('SELECT content FROM volumes WHERE volume = ?',
+                                      (volume,)).fetchone()
+        return row[0] if row else None
+
+    def add_to_volume_cache(self, volume, content, revid=None):
+        index = VolumeIndex(content)
+        index.revid = revid
+        index.fetched = time.time()
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?, ?)',
+                                    (volume, content, revid, index.fetched,
+                                     json.dumps(index.to_dict())))
+        self.remember(('index', volume), index, index.size())
+        return index
+
+    def get_existing(self, titles):
+        titles = list(titles)
+        oldest = time.time() - self.ttl if self.ttl is not None else 0
+        existing = dict()
+        for i in range(0, len(titles), self.max_parameters):
+            batch = titles[i:i + self.max_parameters]
+            rows = self.connection.execute('SELECT title FROM existing WHERE page_exists = 1 AND '
+                                           'checked >= ? AND title IN ({0})'
+                                           .format(','.join('?' * len(batch))), [oldest] + batch)
+            existing.update((title, True) for title, in rows)
+        return existing
+
+    def set_existing(self, results):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO existing VALUES (?, 1, ?)',
+                                        [(title, now) for title, page_exists in results.items()
+                                         if page_exists])
+
+    def get_miss(self, volume, page, title, revid):
+        if revid is None:
+            return None
+        row = self.connection.execute('SELECT message FROM misses WHERE volume = ? AND page = ? '
+                                      'AND title = ? AND revid = ?',
+                                      (volume, page, title, revid)).fetchone()
+        return row[0] if row else None
+
+    def add_miss(self, volume, page, title, revid, message):
+        if revid is None:
+            return
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO misses VALUES (?, ?, ?, ?, ?)',
+                                    (volume, page, title, revid, message))
+
+
+CACHE_BACKENDS = {'files': Cache, 'sqlite': SQLiteCache}
+
+
+class VolumeIndex(object):
+    """A U.S. Reports volume list, parsed once into lookup tables: the case lines by citation
+    ("[volume] U.S. [page]"), by the normalized title of the case they link to, and by each of the
+    words in them."""
+
+    version = 2
+    citation = re.compile(r'(?<!\d)(?P<volume>\d+)\sU\.S\.\s(?P<page>\d+)(?!\d)')
+    link = re.compile(r'\[{2}(?!:?Category)(?P<title>[^\]|]*)(?:\|(?P<text>[^\]]*))?\]{2}')
+    versus = re.compile(r'\bv\.')
+    # Words too common in case names to tell cases apart, as returned by words()
+    common_words = {"the", "et", "al", "of", "a", "for", "and", "inc", "no", "co", "ltd", "l.l.c"}
+
+    def __init__(self, content=None):
+        self.lines = []
+        self.links = []  # Title of the case linked from each line, or None
+        self.citations = dict()  # "volume page" -> numbers of the lines with that citation
+        self.titles = dict()  # Normalized title -> numbers of the lines linking to it
+        self.words = dict()  # Word -> numbers of the lines containing it
+        self.revid = None  # Revision of the volume page the list was taken from, if known
+        self.fetched = 0  # When the revision was last known to be the latest
+        if content:
+            for line in content.splitlines():
+                self.add(line)
+
+    @staticmethod
+    def normalize(title):
+        """Lowercase a title and collapse its whitespace."""
+        return ' '.join(title.lower().split())
+
+    def add(self, line):
+        """Index a single line of the volume list."""
+        number = len(self.lines)
+        self.lines.append(line)
+        for match in self.citation.finditer(line):
+            numbers = self.citations.setdefault(match.group('volume') + ' ' + match.group('page'), [])
+            if number not in numbers:
+                numbers.append(number)
+        match = self.link.search(line)
+        self.links.append(match.group('title').strip() if match else None)
+        if match:
+            for name in set(self.normalize(title) for title in match.group('title', 'text') if title):
+                self.titles.setdefault(name, []).append(number)
+        for word in self.words_in(line):
+            self.words.setdefault(word, []).append(number)
+
+    @classmethod
+    def words_in(cls, text):
+        """The distinct words of a text, lowercased and without surrounding punctuation, leaving
+        out common words."""
+        words = set(word.strip(string.punctuation) for word in text.lower().split())
+        return words.difference(cls.common_words, [''])
+
+    def size(self):
+        """Rough size of the index in memory, in characters."""
+        return sum(len(line) for line in self.lines)
+
+    def by_citation(self, vol, page):
+        """The lines citing [vol] U.S. [page]."""
+        return [self.lines[number] for number in self.citations.get(vol + ' ' + page, [])]
+
+    def by_title(self, title):
+        """The lines linking to a case with this title, ignoring case. If no link matches exactly,
+        fall back to lines that contain the title anywhere."""
+        name = self.normalize(title)
+        if name in self.titles:
+            return [self.lines[number] for number in self.titles[name]]
+        return [line for line in self.lines if name in self.normalize(line)]
+
+    def by_parties(self, title, vol=None, page=None):
+        """The line of the case whose parties best match those of the title, or None. A line has to
+        contain a word of the petitioner and a word of the respondent to match; if several do, the
+        one sharing the most words with the title wins, and ties return None. If a volume and page
+        are given, only the lines with that citation are considered."""
+        parties = self.parties(title)
+        if parties is None:
+            return None
+        petitioner, respondent = parties
+        candidates = self.lines_with(petitioner) & self.lines_with(respondent)
+        if vol is not None:
+            candidates.intersection_update(self.citations.get(vol + ' ' + page, []))
+        return self.best_match(candidates, petitioner | respondent)
+
+    def by_sides(self, title, vol, page):
+        """Like by_parties(), for a case whose citation isn't in the list, so matching is stricter:
+        the words of the petitioner have to come before "v." in the line and those of the
+        respondent after it, and lines citing another page of the volume are a different case."""
+        parties = self.parties(title)
+        if parties is None:
+            return None
+        petitioner, respondent = parties
+        candidates = set()
+        for number in self.lines_with(petitioner) & self.lines_with(respondent):
+            line = self.lines[number]
+            if any(match.group('volume') == vol and match.group('page') != page
+                   for match in self.citation.finditer(line)):
+                continue
+            sides = self.parties(line)
+            if sides and petitioner & sides[0] and respondent & sides[1]:
+                candidates.add(number)
+        return self.best_match(candidates, petitioner | respondent)
+
+    @classmethod
+    def parties(cls, text):
+        """The words of each side of a case name, split at "v.", or None if there aren't two."""
+        sides = cls.versus.split(text)
+        if len(sides) != 2:
+            return None
+        return cls.words_in(sides[0]), cls.words_in(sides[1])
+
+    def best_match(self, candidates, words):
+        """The candidate line sharing the most of the words, or None if there is a tie."""
+        scores = dict((number, 0) for number in candidates)
+        for word in words:
+            for number in self.words.get(word, []):
+                if number in scores:
+                    scores[number] += 1
+        if not scores:
+            return None
+        best = max(scores.values())
+        best_lines = [number for number, score in scores.items() if score == best]
+        return self.lines[best_lines[0]] if len(best_lines) == 1 else None
+
+    def lines_with(self, words):
+        """The numbers of the lines containing any of the words."""
+        return set(number for word in words for number in self.words.get(word, []))
+
+    def to_dict(self):
+        return {'version': self.version, 'lines': self.lines, 'links': self.links,
+                'citations': self.citations, 'titles': self.titles, 'words': self.words,
+                'revid': self.revid, 'fetched': self.fetched}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an index saved with to_dict(), or None if it was saved in an older format."""
+        if data.get('version') != cls.version:
+            return None
+        index = cls()
+        index.lines = data['lines']
+        index.links = data['links']
+        index.citations = data['citations']
+        index.titles = data['titles']
+        index.words = data['words']
+        index.revid = data.get('revid')
+        index.fetched = data.get('fetched', 0)
+        return index
+
+    @classmethod
+    def reindex(cls, content, data=None):
+        """Index a volume list again, keeping the revision recorded in an index saved in an older
+        format, if there is one."""
+        index = cls(content)
+        if data:
+            index.revid = data.get('revid')
+            index.fetched = data.get('fetched', 0)
+        return index
@@ -0,0 +1,130 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from functools import partial
+from multiprocessing import Barrier, Pool
+from threading import BrokenBarrierError
+
+LOGGERS = ('brandeis', 'summary')
+collector = None
+barrier = None
+
+
+class RecordCollector(logging.Handler):
+    """Holds on to the log messages of a worker process so the parent can replay them in input
+    order."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter('%(message)s'))
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.name, record.levelno, self.format(record)))
+
+    def flush_records(self):
+        """Return the messages collected so far and start over with an empty list."""
+        records = self.records
+        self.records = []
+        return records
+
+
+def init_worker(setup=None, setup_args=(), finish_barrier=None):
+    """Replace the handlers inherited from the parent process with a collector, so workers never
+    write to the report and summary logs directly. Then call setup(*setup_args), if given."""
+    global collector, barrier
+    collector = RecordCollector()
+    barrier = finish_barrier
+    for name in LOGGERS:
+        logger = logging.getLogger(name)
+        logger.handlers = [collector]
+        logger.propagate = False
+    if setup:
+        setup(*setup_args)
+
+
+def call(func, file):
+    """Convert a single file. An error in one file is logged and gives a result of None, so it
+    doesn't stop the rest of the batch."""
+    try:
+        return func(file)
+    except Exception as e:
+        logging.getLogger('brandeis').error("Uncaught error while converting {0}: {1}"
+                                            .format(file, repr(e)))
+        return None
+
+
+def run_one(func, file):
+    """Convert a single file in a worker process. Returns the result of the conversion along with
+    the log messages it produced."""
+    result = call(func, file)
+    return result, collector.flush_records()
+
+
+def run_finish(finish, number):
+    """Call finish in a worker process once every worker has taken a finish task, so each of them
+    takes exactly one. Returns the log messages it produced."""
+    try:
+        barrier.wait(timeout=60)
+    except BrokenBarrierError:
+        return []
+    try:
+        finish()
+    except Exception as e:
+        logging.getLogger('brandeis').error("Uncaught error while finishing: " + repr(e))
+    return collector.flush_records()
+
+
+def replay(records):
+    """Re-emit log messages collected in a worker through the parent's handlers."""
+    for name, level, message in records:
+        logging.getLogger(name).log(level, message)
+
+
+def run_batch(func, files, jobs=1, setup=None, setup_args=(), callback=None, finish=None):
+    """Run func on each file, fanning the files out to a pool of jobs processes. Log messages are
+    merged back in the same order as the input files, regardless of which worker finishes first.
+    Each worker calls setup(*setup_args) when it starts; this is how objects that can only be
+    handed to a process as it starts, such as shared memory, reach the workers. callback, if
+    given, is called in this process with each file and its result as soon as the result is
+    available, in input order. finish, if given, is called once in each process after the last
+    file, and its log messages follow those of the files. Returns the list of results in input
+    order."""
+    results = []
+    if jobs <= 1:
+        for file in files:
+            results.append(call(func, file))
+            if callback:
+                callback(file, results[-1])
+        if finish:
+            finish()
+        return results
+    finish_barrier = Barrier(jobs) if finish else None
+    with Pool(processes=jobs, initializer=init_worker,
+              initargs=(setup, setup_args, finish_barrier)) as pool:
+        for file, (result, records) in zip(files, pool.imap(partial(run_one, func), files)):
+            replay(records)
+            results.append(result)
+            if callback:
+                callback(file, result)
+        if finish:
+            for records in pool.map(partial(run_finish, finish), range(jobs), chunksize=1):
+                replay(records)
+    return results
@@ -27,6 +27,7 @@ These are the exceptions used by brandeis:
      +-- NoCaseInList
      +-- PageNotFound
      +-- MultipleCases
+     +-- RequestFailed
     TokenizerError
      +-- IllegalCharacter
     ParserError
@@ -137,6 +138,16 @@ class MultipleCases(APIError):
         return repr(self.value)
 
 
+class RequestFailed(APIError):
+    """An API request still failed after it was retried as many times as allowed."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
 class IllegalCharacter(TokenizerError):
     """The tokenizer encountered an illegal character."""
 
@@ -28,9 +28,10 @@ class BotParser(object):
 
     """
 
-    def __init__(self, inputfile, output, metadict):
+    def __init__(self, inputfile, output, metadict, content=None):
         self.output = output
         self.inputfile = inputfile
+        self.content = content
         self.metadict = metadict
         self.logger = logging.getLogger('brandeis')
         self.summary_logger = logging.getLogger('summary')
@@ -46,7 +47,8 @@ class BotParser(object):
         self.pagelist = ['']
 
     def prepare(self):
-        """Perform the parsing functions. Note the order of some of these functions is important."""
+        """Perform the parsing functions. Note the order of some of these functions is important.
+        Returns whether the bot file was written."""
         try:
             self.sectionize()
             self.footnotes()
@@ -63,9 +65,11 @@ class BotParser(object):
             self.redirect()
         except Exception as e:
             self.logger.error("Uncaught error. Terminating file write. {}".format(e))
+            return False
         else:
             with open(self.output, 'w', encoding="utf-8") as output:
                 output.write('\n'.join(self.pagelist))
+            return True
 
     def add_case_caption(self):
         """Add {{CaseCaption}} to the syllabus page."""
@@ -271,8 +275,10 @@ class BotParser(object):
         self.metadict['sections']['dissent_justices'] = []
         self.metadict['sections']['concurrence'] = []
         self.metadict['sections']['dissent'] = []
-        with open(self.inputfile, encoding='utf-8') as inputfile:
-            content = inputfile.read()
+        if self.content is None:
+            with open(self.inputfile, encoding='utf-8') as inputfile:
+                self.content = inputfile.read()
+        content = self.content
         paras = content.split('\n\n')
         for i in range(len(paras)):
             ind = 0 if len(self.pagelist) == 1 and self.pagelist[0] == '' else -1
@@ -26,14 +26,15 @@ class Bot(object):
 
     """
 
-    def __init__(self, inputfile, output, metadict):
+    def __init__(self, inputfile, output, metadict, content=None):
         self.inputfile = inputfile
         self.output = output
         self.metadict = metadict
-        self.parser = BotParser(self.inputfile, self.output, self.metadict)
+        self.parser = BotParser(self.inputfile, self.output, self.metadict, content)
 
     def prepare(self):
-        """Prepare file so the bot can upload it."""
-        self.parser.prepare()
+        """Prepare file so the bot can upload it. Returns whether the bot file was written."""
+        written = self.parser.prepare()
         if 'pdf' in self.metadict:
             self.metadict['pdf_filename'] = get_scan(self.inputfile, self.metadict['pdf'])
+        return written
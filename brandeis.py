@@ -19,83 +19,296 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import io
 import logging
 import os
 import re
 import sys
+from functools import partial
 from time import strftime, gmtime
 
-from api import API
+from api import API, TokenBucket
+from batch import run_batch
+from lookup import lookup_cases
+from journal import Journal, ReviewQueue, CONVERTED, SKIPPED, DEFERRED, FAILED
+from manifest import Manifest
 from bexceptions import *
 from bot.core import Bot
-from caseparser import Parser, get_metadata, strip_extraneous
+from document import Document
+from caseparser import Parser, get_title_metadata
 from postprocessor import Postprocessor
-from tokenizer import Tokenizer
+from tokenizer import Tokenizer, open_token_dump
 from validator import Validator
 
-# Set up logging
-try:
-    os.mkdir('logs')
-except OSError:
-    pass
 logger = logging.getLogger('brandeis')
 summary_logger = logging.getLogger('summary')
-logger.setLevel(logging.DEBUG)
-summary_logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(message)s')
-console = logging.StreamHandler()
-report = logging.FileHandler("logs/report" + strftime("%H:%M:%S_%d-%m-%Y", gmtime()), encoding='utf-8')
-summary = logging.FileHandler("logs/summary" + strftime("%H:%M:%S_%d-%m-%Y", gmtime()), encoding='utf-8')
-console.setFormatter(formatter)
-report.setFormatter(formatter)
-summary.setFormatter(formatter)
-logger.addHandler(console)
-logger.addHandler(report)
-summary_logger.addHandler(summary)
-summary_logger.info('==Bot run: ' + strftime("%d-%m-%Y, %H:%M:%S (UTC)", gmtime()) + '==')
-
-# Command line parser
-parser = argparse.ArgumentParser(description='Convert the text file of a supreme court case '
-                                             'to wikitext.')
-input_files = parser.add_mutually_exclusive_group(required=True)
-input_files.add_argument('-f', '--files', nargs='*', help='List of files to be parsed.')
-input_files.add_argument('-d', '--dir', nargs=1, help='Directory of files to be parsed.')
-args = vars(parser.parse_args())
-
-# Get list of files
-if args["dir"]:
-    # Directory name was supplied
-    if os.path.isdir(args["dir"][0]):
-        files = os.listdir(args["dir"][0])
-        for i in range(len(files)):
-            files[i] = args["dir"][0] + "/" + files[i]
+SCRATCH = 'cache/stripped'  # Stripped copies of the input files, by the digest of their contents
+api = None
+limiter = None
+manifest = None
+lookups = dict()  # File -> result of looking up its case ahead of time; see look_up()
+titles = dict()  # File -> title metadata read ahead of time, or None; see read_metadata()
+signatures = dict()  # File -> signature of the Document read ahead of time
+
+
+def setup_logging():
+    """Log to the console, the report log and the summary log."""
+    try:
+        os.mkdir('logs')
+    except OSError:
+        pass
+    logger.setLevel(logging.DEBUG)
+    summary_logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(message)s')
+    console = logging.StreamHandler()
+    report = logging.FileHandler("logs/report" + strftime("%H:%M:%S_%d-%m-%Y", gmtime()), encoding='utf-8')
+    summary = logging.FileHandler("logs/summary" + strftime("%H:%M:%S_%d-%m-%Y", gmtime()), encoding='utf-8')
+    console.setFormatter(formatter)
+    report.setFormatter(formatter)
+    summary.setFormatter(formatter)
+    logger.addHandler(console)
+    logger.addHandler(report)
+    summary_logger.addHandler(summary)
+    summary_logger.info('==Bot run: ' + strftime("%d-%m-%Y, %H:%M:%S (UTC)", gmtime()) + '==')
+
+
+def parse_args():
+    """Command line parser."""
+    parser = argparse.ArgumentParser(description='Convert the text file of a supreme court case '
+                                                 'to wikitext.')
+    input_files = parser.add_mutually_exclusive_group(required=True)
+    input_files.add_argument('-f', '--files', nargs='*', help='List of files to be parsed.')
+    input_files.add_argument('-d', '--dir', nargs=1, help='Directory of files to be parsed.')
+    input_files.add_argument('--review', action='store_true',
+                             help='Go through the cases deferred with --on-missing defer, asking '
+                                  'whether to convert each one.')
+    parser.add_argument('--on-missing', choices=['skip', 'continue', 'defer'],
+                        help='What to do with a case that is missing from its volume list or '
+                             'listed more than once: skip it, convert it anyway, or defer it to '
+                             'the review queue. By default, ask.')
+    parser.add_argument('--review-queue', default='logs/review.jsonl',
+                        help='File of the cases deferred for review.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to convert in parallel.')
+    parser.add_argument('--dump-tokens', choices=['plain', 'gzip'],
+                        help='Write the token stream of each case to tokens/ for debugging.')
+    parser.add_argument('--keep-wikitext', action='store_true',
+                        help='Also write the postprocessed wikitext of each case to wikitext/.')
+    parser.add_argument('--pool-size', type=int, default=4,
+                        help='Number of connections to the Wikisource API to keep open.')
+    parser.add_argument('--cache-ttl', type=int, default=86400,
+                        help='Seconds before a cached volume list is checked for new revisions. '
+                             'Use -1 to never check.')
+    parser.add_argument('--cache', choices=['files', 'sqlite'], default='files',
+                        help='Keep the cache as one file per volume list, or in a single SQLite '
+                             'database that also remembers which cases exist.')
+    parser.add_argument('--prefetch-volumes', nargs='?', const='infer', metavar='VOLUMES',
+                        help='Download the U.S. Reports volume lists before converting, e.g. '
+                             '"1-150" or "1-5,20". Without a value, the volumes of the input files '
+                             'are used.')
+    parser.add_argument('--force', action='store_true',
+                        help='Convert every case, even those unchanged since they were last '
+                             'converted.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run, skipping the files it already '
+                             'converted or skipped. Files that failed are tried again.')
+    parser.add_argument('--journal', default='logs/journal.jsonl',
+                        help='File recording the progress of the run, for --resume.')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Number of API requests to make at once when looking up the cases.')
+    parser.add_argument('--rate-limit', type=float, default=10,
+                        help='Most API requests to make per second, across all jobs. Use 0 for no '
+                             'limit.')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='Seconds to wait for a response from the API before retrying.')
+    parser.add_argument('--retries', type=int, default=5,
+                        help='Number of times to retry a failed API request before giving up on '
+                             'the case.')
+    parser.add_argument('--no-lookahead', action='store_true',
+                        help='Look up each case on Wikisource only when it is converted, instead '
+                             'of all at once before the run.')
+    return vars(parser.parse_args())
+
+
+def get_files(args):
+    """Get list of files."""
+    if args["dir"]:
+        # Directory name was supplied
+        if os.path.isdir(args["dir"][0]):
+            files = os.listdir(args["dir"][0])
+            for i in range(len(files)):
+                files[i] = args["dir"][0] + "/" + files[i]
+        else:
+            logger.error('There is no directory at {0}\{1}. Please check the path and retry.'
+                         .format(os.path.dirname(os.path.abspath(__file__)), args["dir"][0]))
+            sys.exit(0)
     else:
-        logger.error('There is no directory at {0}\{1}. Please check the path and retry.'
-                     .format(os.path.dirname(os.path.abspath(__file__)), args["dir"][0]))
-        sys.exit(0)
-else:
-    # List of files was supplied
-    files = args["files"]
+        # List of files was supplied
+        files = args["files"]
+        for file in files:
+            if not os.path.isfile(file):
+                logger.error('There is no file named {0}\{1}. Please check the path and retry.'
+                             .format(os.path.dirname(os.path.abspath(__file__)), file))
+                sys.exit(0)
+    return files
+
+
+def make_dirs():
+    """Create the output directories."""
+    for directory in ('wikitext', 'botfiles', 'botfiles/pdfs'):
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass
+
+
+def decide(message, policy):
+    """Decide what to do with a case that couldn't be matched to a single line of its volume list:
+    'skip', 'continue' or 'defer'. Without a policy, ask."""
+    if policy:
+        return policy
+    return 'continue' if confirm(message) else 'skip'
+
+
+def confirm(message):
+    """Ask whether to continue with a case. Worker processes have no stdin to read from, so the
+    answer is always no when running with --jobs; use --on-missing defer to ask later instead."""
+    try:
+        choice = input(message + ' Continue? (y/n)')
+    except EOFError:
+        return False
+    return choice == 'y' or choice == "Y"
+
+
+def setup_worker(bucket, entries):
+    """Share the state of the run with a process: the token bucket that limits the API requests of
+    all of the jobs, and the manifest of the cases converted before."""
+    global limiter, manifest
+    limiter = bucket
+    manifest = entries
+
+
+def make_api(args):
+    """Set up an API object with the cache and connection options."""
+    ttl = args["cache_ttl"] if args["cache_ttl"] >= 0 else None
+    return API(pool_size=args["pool_size"], cache_ttl=ttl, cache_backend=args["cache"],
+               timeout=args["timeout"], retries=args["retries"], limiter=limiter)
+
+
+def get_api(args):
+    """Every case converted in a process shares one API object, so its connections stay open."""
+    global api
+    if api is None:
+        api = make_api(args)
+    return api
+
+
+def volume_range(text):
+    """Parse a list of volumes and volume ranges such as "1-150" or "1-5,20"."""
+    volumes = []
+    for part in text.split(','):
+        match = re.match(r'^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$', part)
+        if not match:
+            raise ValueError('"{0}" is not a volume or range of volumes.'.format(part))
+        first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+        volumes.extend(str(volume) for volume in range(first, last + 1))
+    return volumes
+
+
+def read_metadata(files):
+    """Get the title and other metadata of each of the input files, as a dict of file -> metadata.
+    Files that can't be read or have no title are left out; they are reported when they are
+    converted. Each file is only read the first time; the metadata is kept in titles, so the
+    stages before the run and convert() share it. The signature of each document is kept too, so
+    convert() can use its stripped copy instead of reading the file again."""
+    metadata = dict()
     for file in files:
-        if not os.path.isfile(file):
-            logger.error('There is no file named {0}\{1}. Please check the path and retry.'
-                         .format(os.path.dirname(os.path.abspath(__file__)), file))
+        if file not in titles:
+            metadict = dict()
+            try:
+                document = Document(file, scratch=SCRATCH)
+                signatures[file] = document.signature
+                get_title_metadata(metadict, [document.title_line])
+            except (AttributeError, OSError, UnicodeDecodeError, ValueError):
+                metadict = None
+            titles[file] = metadict
+        if titles[file] is not None:
+            metadata[file] = titles[file]
+    return metadata
+
+
+def infer_volumes(files):
+    """The volumes of the cases in the input files."""
+    return sorted(set(metadict['volume'] for metadict in read_metadata(files).values()), key=int)
+
+
+def prefetch(args, files):
+    """Download the volume lists needed for the run before any case is converted. Worker
+    processes can't share the parent's connections, so a separate API object is used when
+    converting in parallel."""
+    if args["prefetch_volumes"] == 'infer':
+        volumes = infer_volumes(files)
+    else:
+        try:
+            volumes = volume_range(args["prefetch_volumes"])
+        except ValueError as e:
+            logger.error(str(e) + ' Please check the volumes and retry.')
             sys.exit(0)
+    prefetch_api = get_api(args) if args["jobs"] <= 1 else make_api(args)
+    try:
+        missing = prefetch_api.prefetch_volumes(volumes)
+    except RequestFailed as e:
+        logger.error(e.value + " Continuing without prefetching.")
+        return
+    logger.info('Prefetched {0} volume lists.'.format(len(volumes) - len(missing)))
+    if missing:
+        logger.info('There is no Wikisource page for volumes ' + ', '.join(missing) + '.')
+
+
+def look_up(args, files):
+    """Look up all of the cases on Wikisource at once, before converting any of them. The results
+    are kept in lookups, and the metadata of the files in titles, for convert() to use. Worker
+    processes started by forking inherit them; otherwise each worker falls back to looking up its
+    own cases."""
+    cases = dict((file, (metadict['title'], metadict['volume'], metadict['page']))
+                 for file, metadict in read_metadata(files).items())
+    lookup_api = get_api(args) if args["jobs"] <= 1 else make_api(args)
+    try:
+        lookups.update(lookup_cases(lookup_api, cases, args["concurrency"]))
+    except RequestFailed as e:
+        logger.error(e.value + " Cases will be looked up as they are converted.")
+        return
+    logger.info('Looked up {0} cases on Wikisource.'.format(len(cases)))
+
+
+def report_cache():
+    """Log how well the volume cache of this process did. With --jobs, each worker logs its own."""
+    if api:
+        logging.getLogger('brandeis').info(api.cache.stats())
+
+
+def find_case(api, file, metadict):
+    """Get the line for the case in its volume list, and whether the case already exists on
+    Wikisource. Raises NoCaseInList or MultipleCases if the line can't be found."""
+    result = lookups.get(file)
+    if result is None:
+        line = api.get_case_line(metadict['title'], metadict['volume'], metadict['page'])
+        return line, api.case_exists(line)
+    if isinstance(result, Exception):
+        raise result
+    return result
 
-# Validate and parse each file
-for file in files:
-    metadict = dict()
-    validator = Validator(file)
-    api = API()
 
-    # Remove extra HTML
-    with open(file, encoding='utf-8') as html:
-        raw = html.read()
-        content = strip_extraneous(raw)
+def convert(file, args):
+    """Validate and parse a single file. Returns whether the file was converted, skipped or failed
+    (see journal.py), why, and the manifest entry of the case if it was converted."""
+    api = get_api(args)
 
-    if content:
-        with open(file, 'w', encoding='utf-8') as html:
-            html.write(content)
+    # Read the file once, and remove extra HTML. Every stage below works from this document; the
+    # input file itself is left as it is. If the file was read ahead of time and hasn't changed
+    # since, its stripped copy is used instead of reading it again.
+    document = Document(file, scratch=SCRATCH, signature=signatures.get(file))
+    validator = Validator(file, document)
 
     # Validate the file. Files that do not pass validation are skipped without interrupting the rest
     # of the process.
@@ -103,74 +316,138 @@ for file in files:
         validator.validate()
     except GroupedCase as e:
         logger.info(e.value + " File will be skipped.")
-        continue
+        return SKIPPED, e.value, None
     except ValidatorError as e:
         logger.error(e.value + " File will be skipped.")
-        continue
+        return FAILED, e.value, None
 
-    # Get the title and other metadata
-    get_metadata(metadict, file)
+    # Get the title and other metadata, unless it was read before the run
+    if titles.get(file):
+        metadict = dict(titles[file])
+    else:
+        metadict = dict()
+        get_title_metadata(metadict, [document.title_line])
 
     # Skip if the file exists on Wikisource already
+    line = None
     try:
-        line = api.get_case_line(metadict['title'], metadict['volume'], metadict['page'])
-    except NoCaseInList as e:
-        choice = input(e.value + ' Continue? (y/n)')
-        if choice == 'y' or choice == "Y":
-            logger.info(e.value + " Continuing.")
-        else:
-            logger.info(e.value + " Skipping.")
-            continue
-    except MultipleCases as e:
-        choice = input(e.value + ' Continue? (y/n)')
-        if choice == 'y' or choice == "Y":
+        line, exists = find_case(api, file, metadict)
+    except RequestFailed as e:
+        logger.error(e.value + " File will be skipped.")
+        return FAILED, e.value, None
+    except (NoCaseInList, MultipleCases) as e:
+        decision = decide(e.value, args["on_missing"])
+        if decision == 'continue':
             logger.info(e.value + " Continuing.")
+        elif decision == 'defer':
+            logger.info(e.value + " Deferred for review.")
+            return DEFERRED, e.value, None
         else:
             logger.info(e.value + " Skipping.")
-            continue
+            return SKIPPED, e.value, None
     else:
-        if api.case_exists(line):
+        if exists:
             #             choice = input(metadict['title'] + ' exists on Wikisource. Continue? (y/n)')
             #             if choice == 'n' or choice == "N":
             logger.info(metadict['title'] + " exists on Wikisource. Skipping.")
-            continue
+            return SKIPPED, "Exists on Wikisource.", None
             #             else:
             #                 logger.info(metadict['title'] + " exists on Wikisource. Continuing.")
 
+    # Skip if nothing has changed since the case was last converted
+    out_filename = 'wikitext/' + re.sub(r'[^a-zA-Z0-9_]', '', metadict['title'])
+    bot_filename = out_filename.replace('wikitext', 'botfiles')
+    outputs = [bot_filename] + ([out_filename] if args["keep_wikitext"] else [])
+    if (not args["force"] and manifest and
+            manifest.is_current(file, document.digest, line, outputs)):
+        logger.info(metadict['title'] + " is unchanged since it was last converted. Skipping.")
+        return SKIPPED, "Unchanged since it was last converted.", None
+
     # At this point, we have a valid text file for a case that does not exist on Wikisource
     logger.info("Parsing {0}.".format(metadict['title']))
-    tokenizer = Tokenizer(metadict)
+    sink = None
+    if args["dump_tokens"]:
+        sink = open_token_dump(out_filename.replace('wikitext/', ''), args["dump_tokens"] == 'gzip')
+    tokenizer = Tokenizer(metadict, sink)
     parser = Parser(metadict)
-    try:
-        os.mkdir('wikitext')
-    except OSError:
-        pass
-    out_filename = 'wikitext/' + re.sub(r'[^a-zA-Z0-9_]', '', metadict['title'])
-    postprocessor = Postprocessor(out_filename)
 
-    with open(file, encoding='utf-8') as input_file:
-        raw_text = input_file.read()
-        try:
-            token_stream = tokenizer.analyze(raw_text)
-        except IllegalCharacter as e:
-            logger.error("Illegal character encountered: \"{0}\" at {1}. More: {2}"
-                         .format(raw_text[e.value], e.value,
-                                 (raw_text[e.value:e.value + 20] + "...").replace('\n', '\\n')))
-    with open(out_filename, 'w', encoding='utf-8') as output_file:
-        parser.parse(token_stream, output_file)
-    postprocessor.process()
+    # Each stage hands its text to the next in memory; only the bot file is written, along with
+    # the wikitext if it was asked for.
+    raw_text = document.text
+    wikitext = io.StringIO()
+    try:
+        parser.parse(tokenizer.iter_tokens(raw_text), wikitext)
+    except IllegalCharacter as e:
+        logger.error("Illegal character encountered: \"{0}\" at {1}. More: {2}"
+                     .format(raw_text[e.value], e.value,
+                             (raw_text[e.value:e.value + 20] + "...").replace('\n', '\\n')))
+    finally:
+        if sink:
+            sink.close()
+    postprocessor = Postprocessor(out_filename if args["keep_wikitext"] else None, wikitext.getvalue())
+    content = postprocessor.process()
 
     # Begin the bot parsing
-    try:
-        os.mkdir('botfiles')
-    except OSError:
-        pass
-    try:
-        os.mkdir('botfiles/pdfs')
-    except OSError:
-        pass
-    bot_filename = out_filename.replace('wikitext', 'botfiles')
-    bot = Bot(out_filename, bot_filename, metadict)
-    bot.prepare()
+    bot = Bot(out_filename, bot_filename, metadict, content)
+    written = bot.prepare()
     logger.info('-----')
     summary_logger.info('\n')
+    if not written:
+        return FAILED, "The bot file could not be written; see the report log.", None
+    return CONVERTED, '', Manifest.entry(document.digest, line, outputs)
+
+
+def main():
+    args = parse_args()
+    setup_logging()
+    review = ReviewQueue(args["review_queue"])
+    if args["review"]:
+        # Each case is asked about in turn, so the review is never run in parallel.
+        files = review.files()
+        args["jobs"] = 1
+        args["on_missing"] = None
+        logger.info("{0} cases are waiting for review.".format(len(files)))
+        if not files:
+            return
+    else:
+        files = get_files(args)
+    make_dirs()
+    journal = Journal(args["journal"], args["resume"] or args["review"])
+    if args["resume"] and not args["review"]:
+        remaining = journal.remaining(files)
+        logger.info("Resuming: {0} of {1} files were already processed.".format(
+            len(files) - len(remaining), len(files)))
+        files = remaining
+    setup_worker(TokenBucket(args["rate_limit"]) if args["rate_limit"] > 0 else None,
+                 Manifest())
+    if args["prefetch_volumes"]:
+        prefetch(args, files)
+    if not args["no_lookahead"]:
+        look_up(args, files)
+    converted = []
+
+    def record(file, result):
+        """Note each finished file in the journal, each converted case in the manifest, and each
+        deferred case in the review queue."""
+        status, reason, entry = result or (FAILED, "Uncaught error; see the report log.", None)
+        journal.record(file, status, reason)
+        if status == DEFERRED:
+            review.add(file, reason)
+        elif status != FAILED:
+            review.remove(file)
+        if entry:
+            manifest.record(file, entry)
+            converted.append(file)
+            if len(converted) % 100 == 0:
+                manifest.save()
+
+    try:
+        run_batch(partial(convert, args=args), files, args["jobs"], setup_worker,
+                  (limiter, manifest), record, report_cache)
+    finally:
+        manifest.save()
+        journal.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ import logging
 import re
 
 from bexceptions import EntityError
+from tokenizer import Tokenizer
 
 
 class Parser(object):
@@ -28,59 +29,40 @@ class Parser(object):
     converted to wikitext to be uploaded."""
 
     def __init__(self, metadict):
-        self.tokens = tokens
-        self.value = token[1]
-        self.value = ''
-        self.value = ''
-        self.value = ''
-        self.value = "\n:"
-        self.value = '\n'
-        self.value = ''
-        self.value = ''
-        self.value = ''
-        self.value = ''
-        self.value = ''
-        self.value = '&'
-        self.value = ' '
-        self.value = ''
-        self.value = ''
-        self.value = "''"
-        self.value = "'''"
-        self.value = "\n\n{{right|''" + self.value + "''}}\n\n"
-        self.value = "{{sc|" + self.value.title() + "}}"
-        self.value = '\n:'
-        self.value = '\n'
-        self.value = "<nowiki>" + self.value + "</nowiki>"
-        self.value = '{{***}}'
-        self.value = "<nowiki>*</nowiki>"
-        self.value = ''
+        self.tokens = None
         self.logger = logging.getLogger('brandeis')
         self.output = None
         self.metadict = metadict
+        # Map each token type to the function that converts its value to wikitext
+        self.handlers = dict()
+        for token_type in Tokenizer.tokens:
+            self.handlers[token_type] = getattr(self, token_type.lower())
 
     def parse(self, tokens, output_file):
-        """Run the parser functions on the file."""
+        """Run the parser functions on the file. The tokens can be any iterable, including the
+        generator from Tokenizer.iter_tokens(); they are consumed one at a time."""
+        self.tokens = tokens
         if output_file:
             self.output = output_file
         self.dispatch()
 
     def dispatch(self):
-        """
-
-        """
-        for token in self.tokens:
-            if self.value:
-                command = 'self.{0}()'.format(token[0].lower())
-                try:
-                    exec(command)
-                except AttributeError as e:
-                    self.logger.error("No command for " + command + ". " + repr(e))
-                    break
-                except Exception as e:
-                    self.logger.error("Exception while parsing: " + repr(e))
-                    break
-                else:
-                    self.write(self.value)
+        """Pass the value of each token to the handler for its type, and write the result."""
+        handlers = self.handlers
+        write = self.write
+        for token_type, value in self.tokens:
+            try:
+                handler = handlers[token_type]
+            except KeyError:
+                self.logger.error("No handler for " + token_type + ".")
+                break
+            try:
+                text = handler(value)
+            except Exception as e:
+                self.logger.error("Exception while parsing: " + repr(e))
+                break
+            else:
+                write(text)
 
     def write(self, text):
         """
@@ -96,96 +78,93 @@ class Parser(object):
                 # PARSING FUNCTIONS
                 # ===================================================================================================
 
-    def ignored_tag_content(self):
+    @staticmethod
+    def ignored_tag_content(token):
         """Don't want these tags or their content in the output."""
-        return self.value
+        return ''
 
-    def ignored_tag(self):
+    @staticmethod
+    def ignored_tag(token):
         """'Don't want these tags in the output, but the content is preserved."""
-        return self.value
+        return ''
 
-    def source(self):
+    def source(self, token):
         """Keep in metadict, remove from output."""
-        self.metadict['source'] = self.value
-        return self.value
+        self.metadict['source'] = token
+        return ''
 
-    def blockquote(self):
+    @staticmethod
+    def blockquote(token):
         """
 
         :return:
         """
-        return self.value
+        return '\n:'
 
-    def e_blockquote(self):
+    @staticmethod
+    def e_blockquote(token):
         """
 
         :return:
         """
-        return self.value
+        return '\n'
 
-    def section(self):
+    @staticmethod
+    def section(token):
         """
 
         :return:
         """
-        return self.value
+        return ''
 
-    def b_paragraph(self):
+    @staticmethod
+    def b_paragraph(token):
         """New paragraph within a blockquote; needs its own colon to continue the indentation."""
-        if self.value[0] == '':
-            self.value = '\n\n:'
-        else:
-            pass
-        return self.value
+        if token[0] == '':
+            return '\n\n:'
+        return ''
 
-    def paragraph(self):
+    @staticmethod
+    def paragraph(token):
         """Insert line break if end of paragraph. Ignore otherwise."""
         # TODO: Handle other formatting
-        if self.value[0] == '':
-            self.value = '\n\n'
-        else:
-            pass
-        return self.value
+        if token[0] == '':
+            return '\n\n'
+        return ''
 
-    def link(self):
+    def link(self, token):
         """Extract necessary information from the link's HTML to determine if it should be kept"""
-        info = self.value[0]
-        text = self.value[1]
+        info = token[0]
+        text = token[1]
         m_class = re.search(r'class="(?P<class>.*?)"', info)
         if m_class:
             link_class = m_class.group('class')
             if link_class == 'page-name':
-                self.value = '\nPAGE ' + text + '\n'
-                return self.value
+                return '\nPAGE ' + text + '\n'
             elif link_class == 'page-number':
                 num_m = re.search(r'name="(?P<name>\d+)"', info)
-                self.value = '\nPAGE ' + num_m.group('name') + '\n'
-                return self.value
+                return '\nPAGE ' + num_m.group('name') + '\n'
             elif link_class == 'pdflink':
                 # Hold on to PDF link in case we want it later.
                 m_href = re.search(r'href="(?P<href>.*?)"', info)
                 href = m_href.group('href')
                 self.metadict['pdf'] = href
             elif link_class == "appeallink":
-                self.value = text
-                return self.value
+                return text
         else:
             m_href = re.search(r'''href=["'](?P<href>.*?)["']''', info)
             if m_href:
                 href = m_href.group('href')
                 if 'cases/federal/us' in href:
-                    self.value = text
-                    return self.value
+                    return text
                 else:
                     # Footnotes
                     intext = re.match(r'^#F(?P<number>\d+?(/\d+)?)$', href, re.MULTILINE)
                     if intext:
                         if 'Footnote' in text:
-                            self.value = '<ref name="ref{0}"></ref>'.format(intext.group('number'))
-                            return self.value
+                            return '<ref name="ref{0}"></ref>'.format(intext.group('number'))
                         else:
-                            self.value = text
-                            return self.value
+                            return text
                     else:
                         footnote = re.match(r'^#T(?P<number1>\d+?)(?:/(?P<number2>\d+))?$', href, re.MULTILINE)
                         if footnote:
@@ -193,170 +172,198 @@ class Parser(object):
                                 self.metadict['max_footnote'] = dict()
                             if footnote.group('number2'):
                                 self.metadict['max_footnote'][footnote.group('number1')] = footnote.group('number2')
-                                self.value = 'Footnote {}'.format(
+                                return 'Footnote {}'.format(
                                     footnote.group('number1') + '/' + footnote.group('number2'))
                             else:
                                 self.metadict['max_footnote']['1'] = int(footnote.group('number1'))
-                                self.value = 'Footnote {}'.format(footnote.group('number1'))
-                            return self.value
-        return self.value
+                                return 'Footnote {}'.format(footnote.group('number1'))
+        return ''
 
-    def comment(self):
+    @staticmethod
+    def comment(token):
         """Don't want HTML comments in the output."""
-        return self.value
+        return ''
 
-    def header(self):
+    @staticmethod
+    def header(token):
         """Larger text produced by <h#> tags"""
-        level = self.value[0]
-        content = self.value[1]
+        level = token[0]
+        content = token[1]
         if level == '6' or level == '5' or level == '4':
-            self.value = "'''" + content + "'''"
+            text = "'''" + content + "'''"
         elif level == '3':
-            self.value = '{{larger|' + content + '}}'
+            text = '{{larger|' + content + '}}'
         elif level == '2':
-            self.value = '{{x-larger|' + content + '}}'
-        elif level == '1':
-            self.value = '{{xx-larger|' + content + '}}'
-        self.value += '\n\n'
-        return self.value
+            text = '{{x-larger|' + content + '}}'
+        else:
+            text = '{{xx-larger|' + content + '}}'
+        return text + '\n\n'
 
-    def html_entity(self):
+    @staticmethod
+    def html_entity(token):
         """
 
         :return:
         """
-        if self.value == "quot":
-            self.value = '"'
-        elif self.value == "sect" or self.value == "#167":
-            self.value = '§'
-        elif self.value == "amp":
-            pass
+        if token == "quot":
+            return '"'
+        elif token == "sect" or token == "#167":
+            return '§'
+        elif token == "amp":
+            return '&'
         else:
-            raise EntityError('Unknown entity: ' + self.value)
-        return self.value
+            raise EntityError('Unknown entity: ' + token)
 
-    def whitespace(self):
+    @staticmethod
+    def whitespace(token):
         """
 
         :return:
         """
-        return self.value
+        return ' '
 
-    def supremelinks(self):
+    @staticmethod
+    def supremelinks(token):
         """List of sections. Shouldn't be added to text, not particularly useful to preserve."""
-        return self.value
+        return ''
 
-    def consecutive(self):
+    @staticmethod
+    def consecutive(token):
         """Strips consecutive italics (</i><i>) that occasionally appear"""
-        return self.value
+        return ''
 
-    def italics(self):
+    @staticmethod
+    def italics(token):
         """Wraps text in double apostrophes."""
-        return self.value
+        return "''"
 
-    def bold(self):
+    @staticmethod
+    def bold(token):
         """Wraps text in triple apostrophes."""
-        return self.value
+        return "'''"
 
-    def ordered(self):
+    @staticmethod
+    def ordered(token):
         """
 
         :return:
         """
-        return self.value
+        return "\n\n{{right|''" + token + "''}}\n\n"
 
-    def abbr(self):
+    @staticmethod
+    def abbr(token):
         """
 
         :return:
         """
-        return self.value
+        return token
 
-    def smallcaps(self):
+    @staticmethod
+    def smallcaps(token):
         # Avoid making roman numerals into small caps
         """
 
         :return:
         """
         roman = {'I', 'V', 'X', 'L', 'C', 'D', 'M', '.'}
-        if len(self.value) <= 5:
-            if set(self.value) <= roman:
-                return self.value
-        return self.value
+        if len(token) <= 5:
+            if set(token) <= roman:
+                return token
+        return "{{sc|" + token.title() + "}}"
 
-    def word(self):
+    @staticmethod
+    def word(token):
         """
 
         :return:
         """
-        return self.value
+        return token
 
-    def b_newline(self):
+    @staticmethod
+    def b_newline(token):
         """Newlines within blockquotes need a colon to continue the indentation."""
-        return self.value
+        return '\n:'
 
-    def newline(self):
+    @staticmethod
+    def newline(token):
         """Newlines should be preserved. Extraneous ones will be removed in post-processing."""
-        return self.value
+        return '\n'
 
     @staticmethod
-    def number():
+    def number(token):
         """
 
         """
-        pass
+        return token
 
     @staticmethod
-    def multi_apostrophes():
+    def multi_apostrophes(token):
         """If multiple apostrophes appear in the text (as they do, occasionally, due to bad OCR),
         escape them with <nowiki></nowiki> to avoid borking the italics/bold"""
+        return "<nowiki>" + token + "</nowiki>"
 
     @staticmethod
-    def asterisks():
+    def asterisks(token):
         # For the three-asterisks-in-a-row thing that has no good name
         """
 
         """
-        pass
+        return '{{***}}'
 
-    def punctuation(self):
+    def punctuation(self, token):
         """
 
         """
-        if self.value == "'":
+        if token == "'":
             # Replace apostrophes with ¤ for now to reduce conflicts with italics/bold
-            self.value = "¤"
-        elif self.value == "*":
+            return "¤"
+        elif token == "*":
             # Prevent bullet points
             self.logger.warning("Asterisks found in text. Check for more references.")
+            return "<nowiki>*</nowiki>"
+        return token
 
     @staticmethod
-    def unknown():
+    def unknown(token):
         """
 
         """
-        pass
+        return ''
 
 
 def strip_extraneous(content):
     """Much of the HTML in the page is not useful -- this removes most everything but the case
-    itself. Also removes newlines and tab characters."""
-    match = re.search(r'<article\sid="maincontent">(?P<content>.*?)</article>.*?</html>(?P<source>.*)',
-                      content, flags=re.DOTALL)
-    if match:
-        return (match.group('content') + match.group('source')).replace('\n', '').replace('\t', '')
+    itself. Also removes newlines and tab characters.
+
+    Keeps the text between <article id="maincontent"> and the first </article> after it, and the
+    text after the first </html> following that. The boundaries are found with plain substring
+    searches, so each part of the page is scanned only once."""
+    start = content.find('<article')
+    while start != -1:
+        # The tag name and attribute may be separated by any single whitespace character
+        if content[start + 8:start + 9].isspace() and content.startswith('id="maincontent">',
+                                                                         start + 9):
+            break
+        start = content.find('<article', start + 8)
     else:
         return None
+    start += 26
+    end = content.find('</article>', start)
+    if end == -1:
+        return None
+    source = content.find('</html>', end + 10)
+    if source == -1:
+        return None
+    return (content[start:end] + content[source + 7:]).replace('\n', '').replace('\t', '')
 
 
-def get_metadata(metadict, filename):
-    """Pull the title and other information from the file."""
-    with open(filename, encoding='utf-8') as file:
-        while True:
-            first_line = file.readline()
-            match = re.match(r'^[\n\s\t\r]+$', first_line, re.MULTILINE)
-            if not match:
-                break
+def get_title_metadata(metadict, lines):
+    """Pull the title and other information from the first non-blank line."""
+    first_line = ''
+    for first_line in lines:
+        match = re.match(r'^[\n\s\t\r]+$', first_line, re.MULTILINE)
+        if not match:
+            break
     title = re.match(
         r'[\s\t]*<h1>(?P<full>(?P<title>(?P<petitioner>.*?)\sv\.\s(?P<respondent>.*?))\s-\s(?P<number>(?P<volume>\d{1,3})\s(?P<abbr>U.S.)\s(?P<page>\d{1,3}))\s\((?P<date>\d{4})\))</h1>',
         first_line)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import inspect
+import io
+import os
+import re
+from functools import lru_cache
+from caseparser import strip_extraneous
+
+
+@lru_cache(maxsize=None)
+def stripper_version():
+    """A digest of the source of strip_extraneous(), so files are stripped again whenever it
+    changes."""
+    return hashlib.sha1(inspect.getsource(strip_extraneous).encode('utf-8')).hexdigest()
+
+
+class Document(object):
+    """
+    A case file, read from disk once and shared by every stage that looks at it. raw is the file as
+    it was read, stripped the result of strip_extraneous() (None if the file had already been
+    stripped), and text whichever of the two the rest of the pipeline should use. The title line is
+    found once, when the document is loaded. signature is the digest, size and modification time
+    of the file when it was read, or None if the text was passed in.
+
+    The input file is never changed. If a scratch directory is given, the stripped text is kept
+    there under the SHA-1 digest of the raw file and the version of the stripper, and loading the
+    same file again reads it from there instead of stripping it again. Each input file has one
+    copy at most; the copy made before the file or the stripper changed is removed. Given the
+    signature of an earlier reading, a file that hasn't changed since isn't read again at all; its
+    stripped copy is used instead.
+    """
+
+    def __init__(self, filename, raw=None, scratch=None, signature=None):
+        self.filename = filename
+        self.raw = raw
+        self.signature = None
+        self.stripped = None
+        if raw is None and scratch and signature:
+            self.stripped = self.recall(scratch, signature)
+        if self.stripped is None:
+            if raw is None:
+                with open(filename, encoding='utf-8') as file:
+                    self.raw = file.read()
+                    stat = os.fstat(file.fileno())
+            self.digest = hashlib.sha1(self.raw.encode('utf-8')).hexdigest()
+            if raw is None:
+                self.signature = (self.digest, stat.st_size, stat.st_mtime_ns)
+            self.stripped = self.strip(scratch)
+        self.text = self.stripped or self.raw
+        self.title_line = self.find_title_line(self.text)
+
+    def recall(self, scratch, signature):
+        """The stripped copy of the file as it was when it had this signature, if the file hasn't
+        changed since. Returns None if it has, or if there is no copy or nothing was stripped."""
+        digest, size, mtime = signature
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            return None
+        self.digest = digest
+        try:
+            with open(self.copy_name(scratch), encoding='utf-8') as file:
+                stripped = file.read() or None
+        except (OSError, IOError):
+            return None
+        if stripped is not None:
+            self.signature = signature
+        return stripped
+
+    def strip(self, scratch=None):
+        """Remove the extra HTML, or get the result of doing so from the scratch directory. An
+        empty file in the scratch directory means there was nothing to strip."""
+        if not scratch:
+            return strip_extraneous(self.raw)
+        name = self.copy_name(scratch)
+        try:
+            with open(name, encoding='utf-8') as file:
+                return file.read() or None
+        except (OSError, IOError):
+            pass
+        stripped = strip_extraneous(self.raw)
+        try:
+            directory = os.path.dirname(name)
+            os.makedirs(directory, exist_ok=True)
+            temp_name = '{0}.{1}.tmp'.format(name, os.getpid())
+            with open(temp_name, 'w', encoding='utf-8') as file:
+                file.write(stripped or '')
+            os.replace(temp_name, name)
+            for old in os.listdir(directory):
+                if old != os.path.basename(name) and not old.endswith('.tmp'):
+                    os.remove(os.path.join(directory, old))
+        except (OSError, IOError):
+            pass
+        return stripped
+
+    def copy_name(self, scratch):
+        """Where the stripped copy of this document is kept: a directory for the input file, and
+        in it a file named for the contents of the input file and the version of the stripper."""
+        source = hashlib.sha1(os.path.abspath(self.filename).encode('utf-8')).hexdigest()
+        return os.path.join(scratch, source, '{0}.{1}'.format(self.digest, stripper_version()))
+
+    @staticmethod
+    def find_title_line(text):
+        """The first line of the text that isn't whitespace, or an empty string if there is none.
+        The title of the case should be on this line."""
+        for line in io.StringIO(text):
+            if not re.match(r'^[\n\s\t\r]+$', line, re.MULTILINE):
+                return line
+        return ''
@@ -0,0 +1,132 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Durable records of a batch run: the progress of the run, so a run that was interrupted can be
+resumed without converting the same cases again, and the queue of cases left for a person to
+review.
+"""
+
+import json
+import os
+
+CONVERTED = 'converted'
+SKIPPED = 'skipped'
+DEFERRED = 'deferred'
+FAILED = 'failed'
+
+
+class Journal(object):
+    """
+    Appends one JSON line per input file as soon as the file is finished: its name, whether it
+    was converted, skipped or failed, and why. Each line is flushed to disk before the next file
+    is recorded, so the journal survives the process being killed.
+
+    A new run starts a new journal. When resuming, the old journal is kept and added to, and done
+    holds the files that were converted, skipped or deferred in the runs recorded in it. Failed
+    files are tried again.
+    """
+
+    def __init__(self, filename='logs/journal.jsonl', resume=False):
+        self.filename = filename
+        self.done = set()
+        complete = self.load() if resume else True
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.file = open(filename, 'a' if resume else 'w', encoding='utf-8')
+        if not complete:
+            self.file.write('\n')
+
+    def load(self):
+        """Read the files finished in earlier runs. A line cut off by a crash is ignored. Returns
+        whether the journal ends with a complete line."""
+        line = ''
+        try:
+            with open(self.filename, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry['status'] == FAILED:
+                        self.done.discard(entry['file'])
+                    else:
+                        self.done.add(entry['file'])
+        except (OSError, IOError):
+            pass
+        return not line or line.endswith('\n')
+
+    def remaining(self, files):
+        """The files that still have to be processed, in their original order."""
+        return [file for file in files if file not in self.done]
+
+    def record(self, file, status, reason=''):
+        """Record that a file is finished."""
+        self.file.write(json.dumps({'file': file, 'status': status, 'reason': reason}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if status != FAILED:
+            self.done.add(file)
+
+    def close(self):
+        self.file.close()
+
+
+class ReviewQueue(object):
+    """
+    The cases deferred for review because they couldn't be matched to a single line of their
+    volume list, as a file of JSON lines with the name of each file and why it was deferred. The
+    queue is rewritten in one step whenever it changes.
+    """
+
+    def __init__(self, filename='logs/review.jsonl'):
+        self.filename = filename
+        self.entries = dict()  # File -> reason, in the order the files were deferred
+        try:
+            with open(filename, encoding='utf-8') as queue_file:
+                for line in queue_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['file']] = entry['reason']
+        except (OSError, IOError):
+            pass
+
+    def __contains__(self, file):
+        return file in self.entries
+
+    def files(self):
+        """The files waiting for review, in the order they were deferred."""
+        return list(self.entries)
+
+    def add(self, file, reason):
+        self.entries[file] = reason
+        self.save()
+
+    def remove(self, file):
+        if self.entries.pop(file, None) is not None:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        temp_name = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with open(temp_name, 'w', encoding='utf-8') as queue_file:
+            for file, reason in self.entries.items():
+                queue_file.write(json.dumps({'file': file, 'reason': reason}) + '\n')
+        os.replace(temp_name, self.filename)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Looks up every case of a batch on Wikisource before any of them is converted. The requests for
+all of the cases are made concurrently, so the time spent waiting on the API is close to that of
+the slowest request rather than the sum of all of them.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from bexceptions import NoCaseInList, MultipleCases, PageNotFound
+
+
+class Lookup(object):
+    """
+    Runs the requests of an API object concurrently, at most concurrency at a time. The HTTP
+    client is blocking, so each request runs in a thread; the results are only ever applied to the
+    API object and its cache from the event loop. Requests are still subject to the API object's
+    rate limiter.
+    """
+
+    def __init__(self, api, concurrency=4):
+        self.api = api
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.executor = None
+
+    async def call(self, func, *args):
+        """Run one request in a thread once the concurrency limit allows it."""
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def batches(self, func, items, size, *args):
+        """Call func on items, size at a time, and merge the dicts it returns."""
+        items = list(items)
+        results = dict()
+        for result in await asyncio.gather(*[self.call(func, items[i:i + size], *args)
+                                             for i in range(0, len(items), size)]):
+            results.update(result)
+        return results
+
+    async def resolve(self, cases):
+        """Look up each case, given as a dict of key -> (title, volume, page). Returns a dict of
+        key -> (volume list line, whether the case exists on Wikisource), or the NoCaseInList,
+        MultipleCases or PageNotFound error raised for that case."""
+        api = self.api
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(self.concurrency) as self.executor:
+            # Volume lists
+            fetch, stale = api.plan_volumes(sorted(set(vol for title, vol, page in cases.values()),
+                                                   key=int))
+            revisions = await self.batches(api.query_volumes, stale, api.max_volumes, 'ids')
+            fetch += api.refresh_volumes(stale, revisions)
+            revisions = await self.batches(api.query_volumes, fetch, api.max_volumes, 'content|ids')
+            missing = set(api.store_volumes(revisions))
+
+            # Case lines, from the cached volume lists
+            results = dict()
+            for key, (title, vol, page) in cases.items():
+                if vol in missing:
+                    results[key] = PageNotFound("There is no Wikisource page at {}.".format(
+                        api.base_volume + vol))
+                    continue
+                try:
+                    results[key] = api.get_case_line(title, vol, page)
+                except (NoCaseInList, MultipleCases, PageNotFound) as e:
+                    results[key] = e
+
+            # Whether the cases already exist
+            lines = dict((key, line) for key, line in results.items() if isinstance(line, str))
+            titles = set(api.case_title(line) for line in lines.values())
+            titles = api.unchecked_titles(title for title in titles if title)
+            api.record_existence(await self.batches(api.query_existence, titles, api.max_titles))
+            for key, line in lines.items():
+                results[key] = (line, api.existing.get(api.case_title(line)))
+        return results
+
+
+def lookup_cases(api, cases, concurrency=4):
+    """Look up a batch of cases concurrently. See Lookup.resolve()."""
+    return asyncio.run(Lookup(api, concurrency).resolve(cases))
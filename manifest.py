@@ -0,0 +1,93 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+# The modules whose code decides what a converted case looks like
+PIPELINE_MODULES = ('document.py', 'validator.py', 'caseparser.py', 'tokenizer.py',
+                    'postprocessor.py', 'bot/botparser.py', 'bot/core.py', 'bot/scan.py')
+
+
+@lru_cache(maxsize=None)
+def pipeline_version():
+    """A digest of the source of the conversion pipeline, so cases are converted again whenever
+    the code that converts them changes."""
+    digest = hashlib.sha1()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in PIPELINE_MODULES:
+        with open(os.path.join(base, name), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def line_digest(line):
+    """A digest of a case's line in its volume list. Cases that weren't found in the list have no
+    line, which gets a digest of its own."""
+    return hashlib.sha1((line or '').encode('utf-8')).hexdigest()
+
+
+class Manifest(object):
+    """
+    Records what each input file was converted from: the digest of the file, the digest of the
+    case's line in its volume list, and the version of the pipeline, along with the files it was
+    converted to. A case only has to be converted again if one of these has changed or one of its
+    output files is gone.
+    """
+
+    def __init__(self, filename='cache/manifest.json'):
+        self.filename = filename
+        try:
+            with open(filename, encoding='utf-8') as manifest_file:
+                self.entries = json.load(manifest_file)
+        except (OSError, IOError, ValueError):
+            self.entries = dict()
+
+    @staticmethod
+    def entry(digest, line, outputs):
+        """The manifest entry for a case converted from a file with this digest and volume list
+        line into the output files."""
+        return {'input': digest, 'line': line_digest(line), 'pipeline': pipeline_version(),
+                'outputs': list(outputs)}
+
+    def is_current(self, file, digest, line, outputs):
+        """Whether the outputs the file would be converted to now are up to date. Outputs that
+        weren't written when the case was last converted, such as the wikitext of a case converted
+        without --keep-wikitext, aren't."""
+        entry = self.entries.get(file)
+        if not entry:
+            return False
+        return (entry['input'] == digest and entry['line'] == line_digest(line) and
+                entry['pipeline'] == pipeline_version() and
+                set(outputs) <= set(entry['outputs']) and
+                all(os.path.isfile(output) for output in outputs))
+
+    def record(self, file, entry):
+        self.entries[file] = entry
+
+    def save(self):
+        """Write the manifest. The file is replaced in one step, so it is never left half
+        written."""
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        temp_name = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with open(temp_name, 'w', encoding='utf-8') as manifest_file:
+            json.dump(self.entries, manifest_file)
+        os.replace(temp_name, self.filename)
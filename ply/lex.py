@@ -161,7 +161,6 @@ class Lexer:
     """
 
     def __init__(self):
-        self.lexmatch = m
         self.lexre = None  # Master regular expression. This is a list of
         # tuples (re,findex) where re is a compiled
         # regular expression and findex is a list
@@ -437,6 +436,7 @@ class Lexer:
                 # If token is processed by a function, call it
 
                 tok.lexer = self  # Set additional attributes useful in token rules
+                self.lexmatch = m
                 self.lexpos = lexpos
 
                 newtok = func(tok)
@@ -656,13 +656,6 @@ class LexerReflect(object):
     """
 
     def __init__(self, ldict, log=None, reflags=0):
-        self.literals = self.ldict.get("literals", "")
-        self.states = self.ldict.get("states", None)
-        self.toknames = {}  # Mapping of symbols to token names
-        self.funcsym = {}  # Symbols defined as functions
-        self.strsym = {}  # Symbols defined as strings
-        self.ignore = {}  # Ignore strings by state
-        self.errorf = {}  # Error functions by state
         self.ldict = ldict
         self.error_func = None
         self.tokens = []
@@ -736,12 +729,11 @@ class LexerReflect(object):
             terminals[n] = 1
 
     # Get the literals specifier
-    @staticmethod
-    def get_literals():
+    def get_literals(self):
         """
 
         """
-        pass
+        self.literals = self.ldict.get("literals", "")
 
     # Validate literals
     def validate_literals(self):
@@ -764,6 +756,7 @@ class LexerReflect(object):
         """
 
         """
+        self.states = self.ldict.get("states", None)
         if self.states:
             if not isinstance(self.states, (tuple, list)):
                 self.log.error("states must be defined as a tuple or list")
@@ -801,6 +794,11 @@ class LexerReflect(object):
         tsymbols = [f for f in self.ldict if f[:2] == 't_']
 
         # Now build up a list of functions and a list of strings
+        self.toknames = {}  # Mapping of symbols to token names
+        self.funcsym = {}  # Symbols defined as functions
+        self.strsym = {}  # Symbols defined as strings
+        self.ignore = {}  # Ignore strings by state
+        self.errorf = {}  # Error functions by state
 
         for s in self.stateinfo:
             self.funcsym[s] = []
@@ -19,72 +19,193 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
 
+# A line break and the whitespace, pipes and colons that follow it. All of the line break clean-up
+# happens inside these runs, so each one can be cleaned on its own.
+BREAK_RUN = re.compile(r'(\n[\s|:]*)')
+BREAK_CHARS = re.compile(r'[\s|:]*')
+STRIPPED = ' \t\n\r\f\v'
+PIPE_LINE = re.compile(r'\n\s*\|\s*\n')
+BLANK_LINES = re.compile(r'\n(\s)*\n')
+SINGLE_BREAK = re.compile(r'(?<!\n)\n(?!\n)')
 
-class Postprocessor(object):
-    """
 
-    """
+@lru_cache(maxsize=1024)
+def clean_break(run):
+    """Clean a single run of whitespace around a line break. There are only a handful of distinct
+    runs in any case, so the results are cached."""
+    run = PIPE_LINE.sub('\n\n', run)
+    run = run.replace('\n:\n', '\n')
+    run = BLANK_LINES.sub('\n\n', run)
+    run = run.replace('\n ', '\n')
+    return SINGLE_BREAK.sub('\n\n', run)
+
+
+@lru_cache(maxsize=1024)
+def clean_run(run):
+    """Clean a run twice, as the two line break clean-up passes of the old postprocessor did.
+    clean_break() is not idempotent, so the second pass still changes some runs."""
+    return clean_break(clean_break(run))
+
+
+def bold_spans(content):
+    """Yield the (start, end) positions of each bold span. Triple apostrophes pair up the same way
+    the non-greedy regex used to pair them, skipping any that are escaped with <nowiki>, but the
+    text is only scanned once."""
+    pos = 0
+    while True:
+        start = content.find("'''", pos)
+        while start != -1 and content.endswith('<nowiki>', 0, start):
+            start = content.find("'''", start + 1)
+        if start == -1:
+            return
+        end = content.find("'''", start + 3)
+        while end != -1 and content.startswith('</nowiki>', end + 3):
+            end = content.find("'''", end + 1)
+        if end == -1:
+            return  # No closing apostrophes for this span or any later one
+        yield start, end + 3
+        pos = end + 3
+
+
+def italic_spans(content):
+    """Yield the (start, end) positions of each italic span. Double apostrophes that are part of
+    bold markup or an HTML tag are not treated as italics."""
+    pos = 0
+    while True:
+        start = content.find("''", pos)
+        while start != -1 and (content[start - 1:start] in ("'", ">") or
+                               content[start + 2:start + 3] in ("'", "")):
+            start = content.find("''", start + 1)
+        if start == -1:
+            return
+        end = content.find("''", start + 4)
+        while end != -1 and (content[end - 1] == "'" or content[end + 2:end + 3] in ("'", "<")):
+            end = content.find("''", end + 1)
+        if end == -1:
+            return  # No closing apostrophes for this span or any later one
+        yield start, end + 2
+        pos = end + 2
+
 
-    def __init__(self, file):
+class Postprocessor(object):
+    """Cleans up the wikitext written by the parser. Works on a string in memory; the file is only
+    read if no text is passed in, and only written if a filename is given."""
+
+    def __init__(self, file, content=None):
         self.filename = file
+        self.content = content
 
     def process(self):
-        """Dispatcher method."""
-        self.clean_spaces()
-        self.multiline_bold()
+        """Dispatcher method. Returns the processed text."""
+        if self.content is None:
+            with open(self.filename, encoding='utf-8') as output:
+                self.content = output.read()
+        self.clean()
         #         self.multiline_italic()
-        self.fix_apostrophes()
-        self.clean_spaces()  # Once more for good measure.
-
-    def clean_spaces(self):
-        """Make sure any line break consists of two spaces, avoid lines with just spaces on them."""
-        with open(self.filename, encoding='utf-8') as output:
-            content = output.read()
-        content = content.strip(' \t\n\r\f\v')
-        content = re.sub(r'\n\s*\|\s*\n', '\n\n', content)
-        content = content.replace('\n:\n', '\n')
-        content = re.sub('\n(\s)*\n', '\n\n', content)
-        content = content.replace('\n ', '\n')
-        content = re.sub('(?<!\n)\n(?!\n)', '\n\n', content)
-        with open(self.filename, 'w', encoding='utf-8') as output:
-            output.write(content)
-
-    def fix_apostrophes(self):
-        """Change any literal apostrophes (that were temporarily converted to '¤' characters) back
-        to apostrophes."""
-        with open(self.filename, encoding='utf-8') as output:
-            content = output.read()
-        content = content.replace('¤', "'")
-        with open(self.filename, 'w', encoding='utf-8') as output:
-            output.write(content)
+        if self.filename:
+            with open(self.filename, 'w', encoding='utf-8') as output:
+                output.write(self.content)
+        return self.content
+
+    def clean(self):
+        """Clean up the text in a single scan: make sure any line break consists of two line breaks
+        and avoid lines with just spaces on them, drop empty bold spans, and change any literal
+        apostrophes (that were temporarily converted to '¤' characters) back to apostrophes.
+
+        The result is the same as cleaning the line breaks, dropping the bold spans, restoring the
+        apostrophes and cleaning the line breaks again, one pass after the other. Each run is
+        cleaned twice (see clean_run()); the parts with an empty bold span in them are then fixed
+        up by drop_spans(). Only when dropping a span leaves whitespace at either end of the text
+        is the text cleaned in separate passes instead."""
+        content = self.content.strip(STRIPPED)
+        parts = BREAK_RUN.split(content)
+        raw = parts[:]
+        parts[1::2] = map(clean_run, parts[1::2])
+        parts[::2] = [part.replace('¤', "'") for part in parts[::2]]
+        drops = [start for start, end in bold_spans(content) if end - start == 6]
+        if drops:
+            self.drop_spans(content, raw, parts, drops)
+        self.content = ''.join(parts)
+        if self.content != self.content.strip(STRIPPED):
+            self.content = self.clean_in_passes(content)
+
+    @staticmethod
+    def drop_spans(content, raw, parts, drops):
+        """Remove the empty bold spans starting at drops from the cleaned parts of the content.
+        raw holds the parts before they were cleaned. Where removing a span leaves line break
+        characters right after a run, the second pass would have joined them, and any run after
+        them, into one run, so that run is cleaned as a whole. Only the parts around the spans are
+        looked at."""
+        ends = list(accumulate(map(len, raw)))
+        changed = dict()  # Number of a text part -> starts of the spans in it
+        for start in drops:
+            changed.setdefault(bisect_right(ends, start), []).append(start)
+        for number, starts in changed.items():
+            kept = []
+            last = ends[number] - len(raw[number])
+            for start in starts:
+                kept.append(content[last:start])
+                last = start + 6
+            kept.append(content[last:ends[number]])
+            parts[number] = ''.join(kept).replace('¤', "'")
+        done = 0
+        for number in sorted(changed):
+            if number == 0 or number <= done:
+                continue
+            run = number - 1
+            joined = [clean_break(raw[run])]
+            while True:
+                lead = BREAK_CHARS.match(parts[number]).end()
+                joined.append(parts[number][:lead])
+                parts[number] = parts[number][lead:]
+                if parts[number] or number + 1 == len(parts):
+                    break
+                joined.append(clean_break(raw[number + 1]))
+                parts[number + 1] = ''
+                number += 2
+            if len(joined) > 2 or joined[1]:
+                parts[run] = clean_break(''.join(joined))
+            done = number
+
+    @staticmethod
+    def clean_in_passes(content):
+        """Clean up the text one pass at a time. See clean()."""
+        parts = BREAK_RUN.split(content)
+        parts[1::2] = map(clean_break, parts[1::2])
+        content = Postprocessor.drop_empty_bold(''.join(parts)).replace('¤', "'")
+        parts = BREAK_RUN.split(content.strip(STRIPPED))
+        parts[1::2] = map(clean_break, parts[1::2])
+        return ''.join(parts)
+
+    @staticmethod
+    def drop_empty_bold(content):
+        """Drop the empty bold spans."""
+        pieces = []
+        last = 0
+        for start, end in bold_spans(content):
+            if end - start == 6:
+                pieces.append(content[last:start])
+                last = end
+        pieces.append(content[last:])
+        return ''.join(pieces)
 
     def multiline_bold(self):
-        """Deal with line breaks within bold text."""
-        with open(self.filename, encoding='utf-8') as output:
-            content = output.read()
-        content = re.split(r"(?<!<nowiki>)'''((?:.|\n)*?)'''(?!</nowiki>)", content)
-        new = ''
-        for i in range(len(content)):
-            if content[i]:
-                if i % 2:
-                    new += "'''" + content[i] + "'''"
-                else:
-                    new += content[i]
-        with open(self.filename, 'w', encoding='utf-8') as output:
-            output.write(new)
+        """Deal with line breaks within bold text. Empty bold spans are dropped."""
+        self.content = self.drop_empty_bold(self.content)
 
     def multiline_italic(self):
-        """Deal with line breaks within italic text."""
-        with open(self.filename, encoding='utf-8') as output:
-            content = output.read()
-        content = re.split(r"((?<!('|>))''[^'](?:.|\n)*?[^']''(?!('|<)))", content)
-        new = ''
-        for i in range(len(content)):
-            if content[i]:
-                if i % 2:
-                    new += "''" + content[i] + "''"
-                else:
-                    new += content[i]
-        with open(self.filename, 'w', encoding='utf-8') as output:
-            output.write(new)
+        """Deal with line breaks within italic text. Wikitext italics end at a line break, so they
+        are closed before each paragraph break inside a span and reopened after it."""
+        content = self.content
+        pieces = []
+        last = 0
+        for start, end in italic_spans(content):
+            pieces.append(content[last:start])
+            pieces.append(content[start:end].replace('\n\n', "''\n\n''"))
+            last = end
+        pieces.append(content[last:])
+        self.content = ''.join(pieces)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the throughput of the parser's dispatch table with the exec()-per-token dispatch it
+replaced. Run from the brandeis directory:
+
+    python3 -m tests.benchparser
+"""
+
+import io
+import time
+
+from caseparser import Parser
+from tokenizer import Tokenizer
+
+SAMPLE = ('<p>The COURT held, in 1 U.S. 2, that &quot;the <i>question</i> was</i><i> settled'
+          '&quot; and it is so.</p><blockquote><p>Quoted text<br/>here.</p></blockquote>')
+
+
+class ExecParser(Parser):
+    """The parser as it dispatched before: one exec() per token."""
+
+    def dispatch(self):
+        for token in self.tokens:
+            command = 'self.{0}(token[1])'.format(token[0].lower())
+            exec(command)
+
+
+def run(parser_class, tokens, repeat=3):
+    """Best time, in seconds, for parser_class to convert the tokens."""
+    best = None
+    for i in range(repeat):
+        parser = parser_class(dict())
+        start = time.perf_counter()
+        parser.parse(tokens, io.StringIO())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+
+def main():
+    tokens = Tokenizer(dict()).analyze(SAMPLE * 5000)
+    table = run(Parser, tokens)
+    old = run(ExecParser, tokens)
+    print("{0} tokens".format(len(tokens)))
+    print("exec dispatch:  {0:.3f}s ({1:,.0f} tokens/s)".format(old, len(tokens) / old))
+    print("table dispatch: {0:.3f}s ({1:,.0f} tokens/s)".format(table, len(tokens) / table))
+    print("speedup: {0:.1f}x".format(old / table))
+
+
+if __name__ == '__main__':
+    main()
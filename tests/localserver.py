@@ -0,0 +1,92 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A local stand-in for the Wikisource API, so the API client can be tested without a network
+connection.
+"""
+
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers every request with the JSON returned by the server's respond() function, and keeps
+    count of connections and requests."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        query = dict(parse.parse_qsl(parse.urlsplit(self.path).query))
+        self.server.requests.append(query)
+        response = self.server.respond(query)
+        status, body = response[:2]
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (response[2] if len(response) > 2 else {}).items():
+            self.send_header(name, value)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(object):
+    """Runs the stand-in API on a free port in a background thread. respond(query) takes the
+    parsed query string and returns a (status, JSON body) tuple, or (status, JSON body, headers)
+    to send extra headers. A body given as bytes is sent as is."""
+
+    def __init__(self, respond):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.respond = respond
+        self.server.connections = 0
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_URL(self):
+        return 'http://127.0.0.1:{0}/w/api.php?format=json&action='.format(self.server.server_port)
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -17,16 +17,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from api import API
+from api import API, Cache, ConnectionPool, SQLiteCache, TokenBucket, VolumeIndex
+from email.utils import formatdate
+from multiprocessing import Pool, Process
 from bexceptions import *
+from tests.localserver import LocalServer
+from urllib import error
+import os
+import time
 import unittest
 
+VOLUME = '''==Cases==
+* [http://openjurist.org/1/us/2 1 U.S. 2] ([[:Category:1759 works|1759]]) [[Bethel v. Lloyd]]
+* 1 U.S. 2 (Pa. 1759) [[Hyam v. Edwards]]
+* [http://openjurist.org/1/us/11 1 U.S. 11] [[Hugh Davey et Ux. v. Peter Turner|Davey v. Turner]]
+* 1 U.S. 120 [[Lessee of Pollard's Heirs v. Kibbe]]'''
+
 
 class TestAPIFunctions(unittest.TestCase):
     """Test functions that communicate with the Wikisource API."""
 
     def setUp(self):
-        self.api = API()
+        # Keep the backoff short, so that these fail quickly when there's no network connection
+        self.api = API(retries=1, backoff=0.1)
 
     def tearDown(self):
         pass
@@ -82,5 +95,496 @@ class TestAPIFunctions(unittest.TestCase):
                           "Did not return None for an ambiguous case number AND name.")
 
 
+class TestConnectionPool(unittest.TestCase):
+    """Test the keep-alive HTTP client against a local stand-in for the API."""
+
+    def setUp(self):
+        self.server = LocalServer(self.respond)
+        self.api = API(self.server.base_URL, pool_size=2)
+
+    def tearDown(self):
+        self.server.close()
+
+    @staticmethod
+    def respond(query):
+        if query.get('action') == 'missing':
+            return 404, {}
+        return 200, {'action': query.get('action'), 'text': 'x' * 1000}
+
+    def testKeepAlive(self):
+        for i in range(5):
+            self.api.request(self.api.base_URL + 'parse')
+        self.assertEqual(self.server.connections, 1, 'Connections were not reused between requests.')
+
+    def testGzip(self):
+        self.assertEqual(self.api.request(self.api.base_URL + 'parse')['text'], 'x' * 1000,
+                         'Compressed response was not decoded.')
+
+    def testPoolSize(self):
+        pool = ConnectionPool(size=1)
+        url = self.api.base_URL + 'parse'
+        key = ('http', url.split('/')[2])
+        first, reused = pool.acquire(key)
+        second, reused = pool.acquire(key)
+        pool.release(key, first)
+        pool.release(key, second)
+        self.assertEqual(len(pool.idle[key]), 1, 'Pool kept more idle connections than its size.')
+
+    def testHTTPError(self):
+        with self.assertRaises(error.HTTPError, msg='Error response was not raised.'):
+            self.api.pool.get(self.api.base_URL + 'missing')
+
+
+class TestRetries(unittest.TestCase):
+    """Test the retry policy of API.request()."""
+
+    def setUp(self):
+        self.server = LocalServer(self.respond)
+        self.api = API(self.server.base_URL, retries=3, backoff=0.01)
+        self.failures = 0
+
+    def tearDown(self):
+        self.server.close()
+
+    def respond(self, query):
+        action = query.get('action')
+        if action == 'missing':
+            return 404, {}
+        if action == 'busy' and self.failures < 2:
+            self.failures += 1
+            return 503, {}
+        if action == 'throttled' and self.failures < 1:
+            self.failures += 1
+            return 429, {}, {'Retry-After': '1'}
+        if action == 'garbled' and self.failures < 1:
+            self.failures += 1
+            return 200, b'{"action": "garb'
+        if action == 'invalid':
+            return 200, b'<html>Not JSON</html>'
+        if action == 'slow' and self.failures < 1:
+            self.failures += 1
+            time.sleep(0.5)
+        return 200, {'action': action}
+
+    def testRetry(self):
+        self.assertEqual(self.api.request(self.api.base_URL + 'busy'), {'action': 'busy'})
+        self.assertEqual(len(self.server.requests), 3, 'Unavailable server was not retried.')
+
+    def testRetryAfter(self):
+        start = time.time()
+        self.assertEqual(self.api.request(self.api.base_URL + 'throttled'), {'action': 'throttled'})
+        self.assertGreaterEqual(time.time() - start, 1, 'Retry-After was not respected.')
+
+    def testGiveUp(self):
+        self.api.retries = 1
+        with self.assertRaises(RequestFailed, msg='Kept retrying past the limit.'):
+            self.api.request(self.api.base_URL + 'busy')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def testNoRetry(self):
+        with self.assertRaises(RequestFailed, msg='Error response was not raised.'):
+            self.api.request(self.api.base_URL + 'missing')
+        self.assertEqual(len(self.server.requests), 1, 'Retried a request that could never succeed.')
+
+    def testInvalidResponse(self):
+        self.assertEqual(self.api.request(self.api.base_URL + 'garbled'), {'action': 'garbled'})
+        self.assertEqual(len(self.server.requests), 2, 'Invalid response was not retried.')
+        self.api.retries = 1
+        with self.assertRaises(RequestFailed, msg='Invalid response was not reported.'):
+            self.api.request(self.api.base_URL + 'invalid')
+        self.assertEqual(len(self.server.requests), 4)
+
+    def testTimeout(self):
+        self.api.pool.timeout = 0.2
+        self.api.retries = 0
+        self.api.request(self.api.base_URL + 'parse')
+        with self.assertRaises(RequestFailed, msg='Timeout was retried as a stale connection.'):
+            self.api.request(self.api.base_URL + 'slow')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def testUnreachable(self):
+        self.server.close()
+        with self.assertRaises(RequestFailed, msg='Unreachable server was not reported.'):
+            self.api.request(self.api.base_URL + 'parse')
+
+    def testRetryAfterHeader(self):
+        self.assertEqual(API.retry_after({'Retry-After': '30'}), 30)
+        self.assertAlmostEqual(API.retry_after({'Retry-After': formatdate(time.time() + 60, usegmt=True)}),
+                               60, delta=2)
+        self.assertIsNone(API.retry_after({'Retry-After': 'soon'}))
+        self.assertIsNone(API.retry_after({}))
+
+
+def take_tokens(bucket, count):
+    """Take tokens from a bucket in a separate process."""
+    for i in range(count):
+        bucket.acquire()
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test the request rate limiter."""
+
+    def testBurst(self):
+        bucket = TokenBucket(100, burst=5)
+        start = time.time()
+        take_tokens(bucket, 5)
+        self.assertLess(time.time() - start, 0.05, 'Burst was limited.')
+        take_tokens(bucket, 5)
+        self.assertGreaterEqual(time.time() - start, 0.04, 'Requests past the burst were not limited.')
+
+    def testShared(self):
+        bucket = TokenBucket(20, burst=1)
+        start = time.time()
+        workers = [Process(target=take_tokens, args=(bucket, 3)) for i in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertGreaterEqual(time.time() - start, 0.24, 'Workers did not share the rate limit.')
+
+
+class TestExistenceChecks(unittest.TestCase):
+    """Test batched existence checks against a local stand-in for the API."""
+
+    def setUp(self):
+        self.server = LocalServer(self.respond)
+        self.api = API(self.server.base_URL)
+
+    def tearDown(self):
+        self.server.close()
+
+    @staticmethod
+    def respond(query):
+        pages = dict()
+        normalized = []
+        for i, title in enumerate(query['titles'].split('|')):
+            if title[0].islower():
+                normalized.append({'from': title, 'to': title[0].upper() + title[1:]})
+                title = title[0].upper() + title[1:]
+            if 'Missing' in title:
+                pages[str(-i - 1)] = {'ns': 0, 'title': title, 'missing': ''}
+            else:
+                pages[str(i + 1)] = {'pageid': i + 1, 'ns': 0, 'title': title}
+        return 200, {'query': {'normalized': normalized, 'pages': pages}}
+
+    def testBatchedChecks(self):
+        lines = ['* [http://openjurist.org/1/us/{0} 1 U.S. {0}] ([[:Category:1790 works|1790]]) '
+                 '[[Case {0} v. {1}]]'.format(i, 'Missing' if i % 3 else 'Present') for i in range(120)]
+        self.api.pending.update(title for title in VolumeIndex('\n'.join(lines)).links if title)
+        results = [self.api.case_exists(line) for line in lines]
+        self.assertEqual(results, [not i % 3 for i in range(120)], 'Incorrect existence results.')
+        self.assertEqual(len(self.server.requests), 3, 'Titles were not checked in batches of 50.')
+
+    def testNormalizedTitle(self):
+        self.assertTrue(self.api.case_exists('* 1 U.S. 2 [[lower v. Case|Lower v. Case]]'),
+                        'Normalized title was not matched to the one requested.')
+
+    def testSameNormalizedTitle(self):
+        self.assertEqual(self.api.query_existence(['lower v. Case', 'Lower v. Case']),
+                         {'lower v. Case': True, 'Lower v. Case': True},
+                         'Titles normalized to the same page were not all matched to it.')
+
+    def testNoLink(self):
+        self.assertIsNone(self.api.case_exists('* 1 U.S. 2 ([[:Category:1790 works|1790]])'),
+                          'Returned a result for a line with no case link.')
+
+
+class TestVolumeIndex(unittest.TestCase):
+    """Test lookups in a parsed volume list."""
+
+    def setUp(self):
+        self.index = VolumeIndex(VOLUME)
+
+    def testCitation(self):
+        self.assertEqual(self.index.by_citation('1', '2'), VOLUME.splitlines()[1:3],
+                         'Incorrect lines returned for a citation.')
+        self.assertEqual(self.index.by_citation('1', '12'), [],
+                         'Returned lines for a citation that is not in the list.')
+
+    def testTitle(self):
+        self.assertEqual(self.index.by_title('DAVEY  v. turner'), [VOLUME.splitlines()[3]],
+                         'Did not find a case by the text of its link.')
+        self.assertEqual(self.index.by_title("Pollard's Heirs"), [VOLUME.splitlines()[4]],
+                         'Did not fall back to part of a title.')
+
+    def testParties(self):
+        self.assertEqual(self.index.by_parties('Bethel v. Lloyd', '1', '2'), VOLUME.splitlines()[1],
+                         'Did not pick the matching case out of several with the same citation.')
+        self.assertIsNone(self.index.by_parties('Bethel v. Lloyd', '1', '11'),
+                          'Returned a case with a different citation.')
+        self.assertEqual(self.index.by_parties('Heirs of Pollard v. Kibbe et al.'),
+                         VOLUME.splitlines()[4], 'Did not match a reworded title.')
+        self.assertIsNone(self.index.by_parties('Pollard v. Lloyd'),
+                          'Matched a case with only one of the parties.')
+        self.assertIsNone(self.index.by_parties('Pollard'), 'Matched a title without parties.')
+
+    def testSides(self):
+        index = VolumeIndex('* 5 U.S. 10 [[Smith v. United States]]\n'
+                            '* [[Heirs of Pollard v. Kibbe]]')
+        self.assertIsNone(index.by_sides('United States v. Smith', '5', '99'),
+                          'Matched a case with the parties on the wrong sides.')
+        self.assertIsNone(index.by_sides('Smith v. United States', '5', '99'),
+                          'Matched a case cited at another page of the volume.')
+        self.assertIn('Smith', index.by_sides('Smith v. United States', '4', '99'),
+                      'Did not match a case cited in another volume.')
+        self.assertIn('Pollard', index.by_sides("Lessee of Pollard's Heirs v. Kibbe", '5', '99'),
+                      'Did not match a case without a citation.')
+
+    def testBestScore(self):
+        index = VolumeIndex('* 1 U.S. 5 [[Respublica v. Sweers]]\n'
+                            '* 1 U.S. 5 [[Respublica v. Cornelius Sweers]]\n'
+                            '* 1 U.S. 5 [[Respublica v. Cornelius Sweers and the Ship Molly]]')
+        self.assertIsNone(index.by_parties('Respublica v. Sweers'), 'Did not return None for a tie.')
+        self.assertIn('Molly', index.by_parties('Respublica v. Ship Molly Sweers'),
+                      'Did not return the best scoring case.')
+
+    def testSerialization(self):
+        index = VolumeIndex.from_dict(self.index.to_dict())
+        self.assertEqual(index.by_citation('1', '11'), self.index.by_citation('1', '11'),
+                         'Index changed when saved and loaded.')
+        self.assertEqual(index.by_parties('Bethel v. Lloyd'), self.index.by_parties('Bethel v. Lloyd'),
+                         'Index changed when saved and loaded.')
+
+    def testOldFormat(self):
+        data = self.index.to_dict()
+        data['version'] = 1
+        data['revid'] = 100
+        self.assertIsNone(VolumeIndex.from_dict(data), 'Loaded an index in an older format.')
+        self.assertEqual(VolumeIndex.reindex(VOLUME, data).revid, 100,
+                         'Revision was lost when indexing the volume again.')
+
+
+class TestCaseLine(unittest.TestCase):
+    """Test get_case_line() against a local stand-in for the API."""
+
+    def setUp(self):
+        self.server = LocalServer(self.respond)
+        self.api = API(self.server.base_URL)
+
+    def tearDown(self):
+        self.server.close()
+        for name in ('cache/999', 'cache/999.json'):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    revid = 100
+
+    def respond(self, query):
+        revision = {'revid': self.revid}
+        if 'content' in query['rvprop']:
+            revision['*'] = VOLUME.replace(' 1 U.S.', ' 999 U.S.')
+        return 200, {'query': {'pages': {'1': {'title': query['titles'], 'revisions': [revision]}}}}
+
+    def testIndexedLookups(self):
+        self.assertIn('Bethel v. Lloyd', self.api.get_case_line('Bethel v. Lloyd', '999', '2'),
+                      'Multiple citation matches were not filtered by title.')
+        self.assertIn('Pollard', self.api.get_case_line("Lessee of Pollard's Heirs v. Kibbe", '999', '99'),
+                      'Did not fall back to the title.')
+        with self.assertRaises(NoCaseInList, msg='Returned an entry for a non-existent case.'):
+            self.api.get_case_line('CaseName', '999', '800')
+        with self.assertRaises(NoCaseInList, msg='Returned an entry for a different case.'):
+            self.api.get_case_line('Kibbe v. Pollard', '999', '99')
+        self.assertEqual(len(self.server.requests), 1, 'Volume list was not cached.')
+        self.assertTrue(os.path.isfile('cache/999.json'), 'Volume index was not saved.')
+        self.assertEqual(self.api.cache.hits, 3, 'Volume index was not kept in memory.')
+        self.assertEqual(self.api.cache.misses, 1, 'A lookup was counted more than once.')
+        self.assertEqual(list(self.api.cache.memory), [('index', '999')],
+                         'Volume text was kept in memory next to its index.')
+
+    def testRevisionCheck(self):
+        self.api.cache.ttl = 0
+        self.api.get_case_line('Bethel v. Lloyd', '999', '2')
+        self.api.get_case_line('Bethel v. Lloyd', '999', '2')
+        self.assertEqual([query['rvprop'] for query in self.server.requests], ['content|ids', 'ids'],
+                         'Downloaded an unchanged volume list again.')
+        self.revid = 101
+        self.api.get_case_line('Bethel v. Lloyd', '999', '2')
+        self.assertEqual(self.server.requests[-1]['rvprop'], 'content|ids',
+                         'Did not download an edited volume list.')
+        self.assertEqual(self.api.cache.get_volume_index('999').revid, 101)
+
+    def testFreshCache(self):
+        self.api.get_case_line('Bethel v. Lloyd', '999', '2')
+        self.api.cache.memory.clear()
+        self.api.get_case_line('Bethel v. Lloyd', '999', '2')
+        self.assertEqual(len(self.server.requests), 1, 'Checked the revision of a fresh volume list.')
+
+
+class TestMemoryCache(unittest.TestCase):
+    """Test the in-memory layer of the volume cache."""
+
+    def setUp(self):
+        self.cache = Cache(max_size=10)
+
+    def testHitsAndMisses(self):
+        self.assertIsNone(self.cache.recall(('text', '1')))
+        self.cache.remember(('text', '1'), 'abcd', 4)
+        self.assertEqual(self.cache.recall(('text', '1')), 'abcd')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1), 'Hits or misses were miscounted.')
+
+    def testEviction(self):
+        self.cache.remember(('text', '1'), 'abcd', 4)
+        self.cache.remember(('text', '2'), 'efgh', 4)
+        self.cache.recall(('text', '1'))
+        self.cache.remember(('text', '3'), 'ijkl', 4)
+        self.assertIn(('text', '1'), self.cache.memory, 'Evicted the most recently used entry.')
+        self.assertNotIn(('text', '2'), self.cache.memory, 'Did not evict the least recently used entry.')
+        self.assertEqual(self.cache.size, 8)
+        self.cache.remember(('text', '4'), 'x' * 11, 11)
+        self.assertNotIn(('text', '4'), self.cache.memory, 'Kept an entry larger than the cache.')
+
+    def testReindexCountedOnce(self):
+        Cache().add_to_volume_cache('998', VOLUME, 100)
+        os.remove('cache/998.json')
+        cache = Cache()
+        try:
+            self.assertEqual(cache.get_volume_index('998').revid, None)
+            self.assertEqual((cache.hits, cache.misses), (0, 1),
+                             'Indexing a volume again was counted as more than one lookup.')
+            self.assertEqual(list(cache.memory), [('index', '998')],
+                             'Volume text was kept in memory next to its index.')
+        finally:
+            for name in ('cache/998', 'cache/998.json'):
+                os.remove(name)
+
+
+class TestPrefetch(unittest.TestCase):
+    """Test downloading volume lists in bulk."""
+
+    volumes = [str(volume) for volume in range(980, 995)]
+
+    def setUp(self):
+        self.server = LocalServer(self.respond)
+        self.api = API(self.server.base_URL)
+        self.revid = 100
+
+    def tearDown(self):
+        self.server.close()
+        for volume in self.volumes:
+            for name in ('cache/' + volume, 'cache/' + volume + '.json'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def respond(self, query):
+        pages = dict()
+        for i, title in enumerate(query['titles'].split('|')):
+            if title.endswith('994'):
+                pages[str(-i - 1)] = {'ns': 0, 'title': title, 'missing': ''}
+                continue
+            revision = {'revid': self.revid}
+            if 'content' in query['rvprop']:
+                revision['*'] = VOLUME.replace(' 1 U.S.', ' {0} U.S.'.format(title.split()[-1]))
+            pages[str(i + 1)] = {'title': title, 'revisions': [revision]}
+        return 200, {'query': {'pages': pages}}
+
+    def testPrefetch(self):
+        self.assertEqual(self.api.prefetch_volumes(self.volumes), ['994'],
+                         'Did not report the volume with no page.')
+        self.assertEqual(len(self.server.requests), 2, 'Volumes were not fetched in batches.')
+        self.assertIn('Bethel v. Lloyd', self.api.get_case_line('Bethel v. Lloyd', '985', '2'))
+        self.assertEqual(len(self.server.requests), 2, 'Prefetched volume was downloaded again.')
+
+    def testPrefetchStale(self):
+        self.api.prefetch_volumes(self.volumes)
+        self.api.cache.ttl = 0
+        self.revid = 101
+        self.api.prefetch_volumes(self.volumes[:10])
+        self.assertEqual([query['rvprop'] for query in self.server.requests[2:]], ['ids', 'content|ids'],
+                         'Edited volume lists were not checked by revision and downloaded again.')
+        self.assertEqual(self.api.cache.get_volume_index('980').revid, 101)
+
+    def testPartialResponse(self):
+        respond = self.respond
+
+        def truncated(query):
+            status, body = respond(query)
+            pages = body['query']['pages']
+            for key in sorted(pages)[1:]:
+                pages[key].pop('revisions', None)
+            return status, body
+
+        self.server.server.respond = truncated
+        self.assertEqual(self.api.prefetch_volumes(self.volumes[:3]), [])
+        self.assertEqual(len(self.server.requests), 3, 'Left out volumes were not asked for again.')
+
+
+def add_volume(volume):
+    """Add a volume to the test database from a separate process."""
+    cache = SQLiteCache()
+    cache.filename = TestSQLiteCache.filename
+    cache.add_to_volume_cache(volume, VOLUME, int(volume))
+    cache.set_existing({'Case ' + volume: True})
+
+
+class TestSQLiteCache(unittest.TestCase):
+    """Test the SQLite cache backend."""
+
+    filename = 'cache/test.sqlite3'
+
+    def setUp(self):
+        self.cache = self.open()
+
+    def tearDown(self):
+        self.cache.connection.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.filename + suffix)
+            except OSError:
+                pass
+
+    def open(self, ttl=86400):
+        """Open the test database without anything in memory, as another run would."""
+        cache = SQLiteCache(ttl=ttl)
+        cache.filename = self.filename
+        return cache
+
+    def testVolumes(self):
+        self.assertIsNone(self.cache.get_volume_index('1'))
+        self.cache.add_to_volume_cache('1', VOLUME, 100)
+        index = self.open().get_volume_index('1')
+        self.assertEqual((index.lines, index.revid), (VOLUME.splitlines(), 100),
+                         'Volume index was not stored.')
+        self.assertEqual(self.open().get_cached_volume('1'), VOLUME, 'Volume text was not stored.')
+
+    def testExisting(self):
+        self.cache.set_existing({'Present': True, 'Missing': False})
+        self.assertEqual(self.open().get_existing(['Present', 'Missing', 'Unchecked']),
+                         {'Present': True}, 'Existence checks were not stored, or a missing page '
+                                            'was remembered.')
+        self.assertEqual(self.open(ttl=0).get_existing(['Present']), {},
+                         'Returned an expired existence check.')
+
+    def testMisses(self):
+        self.cache.add_miss('1', '2', 'CaseName', 100, 'Not found.')
+        self.assertEqual(self.open().get_miss('1', '2', 'CaseName', 100), 'Not found.')
+        self.assertIsNone(self.open().get_miss('1', '2', 'CaseName', 101),
+                          'Returned a miss from an older revision of the volume list.')
+
+    def testParallelWorkers(self):
+        volumes = [str(i) for i in range(1, 9)]
+        with Pool(4) as pool:
+            pool.map(add_volume, volumes)
+        for volume in volumes:
+            self.assertEqual(self.cache.get_volume_index(volume).revid, int(volume),
+                             'Lost a volume written by a parallel worker.')
+        self.assertEqual(len(self.cache.get_existing('Case ' + volume for volume in volumes)), 8,
+                         'Lost an existence check written by a parallel worker.')
+
+    def testCaseExists(self):
+        server = LocalServer(TestExistenceChecks.respond)
+        try:
+            for i in range(2):
+                api = API(server.base_URL, cache_backend='sqlite')
+                api.cache.filename = self.filename
+                self.assertTrue(api.case_exists('* 1 U.S. 2 [[Case v. Present]]'))
+            self.assertEqual(len(server.requests), 1, 'Existence check was not remembered.')
+        finally:
+            server.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+import unittest
+
+from batch import RecordCollector, run_batch
+
+
+def slow_echo(name):
+    """Finish the first files last, so the workers return out of order."""
+    time.sleep(0.05 * (3 - int(name)))
+    logging.getLogger('brandeis').info("Converted " + name)
+    return name
+
+
+def broken(name):
+    raise ValueError(name)
+
+
+setting = None
+
+
+def set_setting(value):
+    global setting
+    setting = value
+
+
+def get_setting(name):
+    return setting
+
+
+def report_setting():
+    logging.getLogger('brandeis').info("Finished with " + str(setting))
+
+
+class TestBatch(unittest.TestCase):
+    """Test the process pool used by --jobs."""
+
+    def setUp(self):
+        self.logger = logging.getLogger('brandeis')
+        self.collector = RecordCollector()
+        self.logger.addHandler(self.collector)
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.collector)
+
+    def testResultsInInputOrder(self):
+        self.assertEqual(run_batch(slow_echo, ['0', '1', '2', '3'], jobs=4), ['0', '1', '2', '3'],
+                         'Results were not returned in input order.')
+
+    def testLogsInInputOrder(self):
+        run_batch(slow_echo, ['0', '1', '2', '3'], jobs=4)
+        self.assertEqual([record[2] for record in self.collector.records],
+                         ['Converted 0', 'Converted 1', 'Converted 2', 'Converted 3'],
+                         'Worker log messages were not merged in input order.')
+
+    def testSequential(self):
+        self.assertEqual(run_batch(slow_echo, ['2', '3'], jobs=1), ['2', '3'],
+                         'Sequential run returned incorrect results.')
+
+    def testSetup(self):
+        self.assertEqual(run_batch(get_setting, ['a', 'b'], jobs=2, setup=set_setting,
+                                   setup_args=('on',)), ['on', 'on'], 'Workers were not set up.')
+
+    def testFinish(self):
+        run_batch(get_setting, ['a', 'b', 'c'], jobs=2, setup=set_setting, setup_args=('on',),
+                  finish=report_setting)
+        self.assertEqual([record[2] for record in self.collector.records],
+                         ['Finished with on', 'Finished with on'],
+                         'Each worker did not finish exactly once.')
+
+    def testCallback(self):
+        for jobs in (1, 4):
+            seen = []
+            run_batch(slow_echo, ['0', '1', '2', '3'], jobs=jobs,
+                      callback=lambda file, result: seen.append((file, result)))
+            self.assertEqual(seen, [('0', '0'), ('1', '1'), ('2', '2'), ('3', '3')],
+                             'Results were not passed on in input order.')
+
+    def testWorkerError(self):
+        for jobs in (1, 2):
+            self.collector.flush_records()
+            self.assertEqual(run_batch(broken, ['a', 'b'], jobs=jobs), [None, None],
+                             'An error in one file did not leave the rest of the batch running.')
+            self.assertEqual(len(self.collector.records), 2, 'Worker errors were not logged.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import brandeis
+from bot.botparser import BotParser
+from journal import CONVERTED, FAILED
+from manifest import Manifest
+
+PAGE = '<h1>Foo v. Bar - 100 U.S. 200 (2013)</h1><p>Text of the opinion.</p>'
+LINE = '* 100 U.S. 200 [[Foo v. Bar]]'
+ARGS = {'on_missing': None, 'force': False, 'dump_tokens': None, 'keep_wikitext': False,
+        'pool_size': 1, 'cache_ttl': 86400, 'cache': 'files', 'timeout': 1, 'retries': 0}
+
+
+def write_bot_file(parser):
+    with open(parser.output, 'w', encoding='utf-8') as output:
+        output.write('Bot file')
+    return True
+
+
+class TestConvert(unittest.TestCase):
+    """Test what convert() reports for a single case."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        brandeis.make_dirs()
+        with open('case.html', 'w', encoding='utf-8') as case_file:
+            case_file.write(PAGE)
+        brandeis.setup_worker(None, Manifest())
+        brandeis.lookups['case.html'] = (LINE, False)
+
+    def tearDown(self):
+        brandeis.lookups.clear()
+        brandeis.titles.clear()
+        brandeis.signatures.clear()
+        brandeis.api = None
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def testConverted(self):
+        with mock.patch.object(BotParser, 'prepare', write_bot_file):
+            status, reason, entry = brandeis.convert('case.html', ARGS)
+        self.assertEqual(status, CONVERTED, 'Case with a bot file was not reported as converted.')
+        self.assertEqual(entry['outputs'], ['botfiles/FoovBar'], 'Incorrect outputs recorded.')
+
+    def testNotWritten(self):
+        with mock.patch.object(BotParser, 'prepare', lambda parser: False):
+            status, reason, entry = brandeis.convert('case.html', ARGS)
+        self.assertEqual(status, FAILED, 'Case without a bot file was not reported as failed.')
+        self.assertIsNone(entry, 'Case without a bot file was recorded in the manifest.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from document import Document, stripper_version
+
+PAGE = ('<html><head><title>Foo</title></head><body>\n<article id="maincontent">\n\t<h1>Foo v. Bar'
+        ' - 100 U.S. 200 (2013)</h1>\n<p>Text</p></article>\n</body></html>Source')
+
+
+class TestDocument(unittest.TestCase):
+    """Test loading a case file."""
+
+    def testStrip(self):
+        document = Document('case.html', PAGE)
+        self.assertEqual(document.text, '<h1>Foo v. Bar - 100 U.S. 200 (2013)</h1><p>Text</p>Source',
+                         'Extra HTML was not removed.')
+        self.assertEqual(document.title_line, document.text, 'Title line was not found.')
+
+    def testAlreadyStripped(self):
+        document = Document('case.html', '\n  \n\t<h1>Foo v. Bar - 100 U.S. 200 (2013)</h1>\n<p>')
+        self.assertIsNone(document.stripped)
+        self.assertEqual(document.title_line, '\t<h1>Foo v. Bar - 100 U.S. 200 (2013)</h1>\n',
+                         'Title line was not found after blank lines.')
+
+    def testScratch(self):
+        with tempfile.TemporaryDirectory() as scratch:
+            document = Document('case.html', PAGE, scratch)
+            name = document.copy_name(scratch)
+            with open(name, encoding='utf-8') as file:
+                self.assertEqual(file.read(), document.text, 'Stripped text was not kept.')
+            with open(name, 'w', encoding='utf-8') as file:
+                file.write('<h1>Kept v. Copy - 1 U.S. 2 (1790)</h1>')
+            self.assertIn('Kept', Document('case.html', PAGE, scratch).text,
+                          'File was stripped again although its digest was unchanged.')
+            self.assertIn('Foo', Document('case.html', PAGE + ' ', scratch).text,
+                          'Kept copy was used for a changed file.')
+            self.assertFalse(os.path.exists(name), 'Copy of the changed file was not removed.')
+            stripped = Document('case.html', '<h1>Foo v. Bar - 1 U.S. 2 (1790)</h1>', scratch)
+            self.assertIsNone(Document('case.html', stripped.raw, scratch).stripped,
+                              'Kept copy of a file with nothing to strip was not recognized.')
+
+    def testStripperChanged(self):
+        with tempfile.TemporaryDirectory() as scratch:
+            name = Document('case.html', PAGE, scratch).copy_name(scratch)
+            with open(name, 'w', encoding='utf-8') as file:
+                file.write('<h1>Kept v. Copy - 1 U.S. 2 (1790)</h1>')
+            os.rename(name, name.replace(stripper_version(), 'old'))
+            document = Document('case.html', PAGE, scratch)
+            self.assertIn('Foo', document.text, 'Copy made by another stripper was used.')
+            self.assertEqual(os.listdir(os.path.dirname(name)), [os.path.basename(name)],
+                             'Copy made by another stripper was not removed.')
+
+    def testSignature(self):
+        with tempfile.TemporaryDirectory() as directory:
+            scratch = os.path.join(directory, 'stripped')
+            filename = os.path.join(directory, 'case.html')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write(PAGE)
+            signature = Document(filename, scratch=scratch).signature
+            document = Document(filename, scratch=scratch, signature=signature)
+            self.assertIsNone(document.raw, 'Unchanged file was read again.')
+            self.assertEqual(document.digest, signature[0], 'Digest was not kept.')
+            self.assertEqual(document.signature, signature, 'Signature was not kept.')
+            self.assertIn('Foo v. Bar', document.title_line, 'Title line was not found.')
+            with open(filename, 'a', encoding='utf-8') as file:
+                file.write('More')
+            document = Document(filename, scratch=scratch, signature=signature)
+            self.assertEqual(document.raw, PAGE + 'More', 'Changed file was not read again.')
+            self.assertNotEqual(document.digest, signature[0])
+
+    def testNoTitle(self):
+        self.assertEqual(Document('case.html', '\n\n\t\t').title_line, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from journal import Journal, ReviewQueue, CONVERTED, SKIPPED, FAILED
+
+
+class TestJournal(unittest.TestCase):
+    """Test the progress record used to resume runs."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'journal.jsonl')
+        journal = Journal(self.filename)
+        journal.record('a.html', CONVERTED)
+        journal.record('b.html', SKIPPED, 'Exists on Wikisource.')
+        journal.record('c.html', FAILED, 'HTTP error 500.')
+        journal.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def testResume(self):
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(journal.remaining(['a.html', 'b.html', 'c.html', 'd.html']),
+                         ['c.html', 'd.html'], 'Incorrect files left to process.')
+        journal.record('c.html', CONVERTED)
+        journal.close()
+        self.assertEqual(Journal(self.filename, resume=True).remaining(['a.html', 'c.html']), [],
+                         'Progress of the resumed run was not recorded.')
+
+    def testNewRun(self):
+        Journal(self.filename).close()
+        self.assertEqual(Journal(self.filename, resume=True).remaining(['a.html']), ['a.html'],
+                         'A new run did not start a new journal.')
+
+    def testCutOffLine(self):
+        with open(self.filename, 'a', encoding='utf-8') as journal_file:
+            journal_file.write('{"file": "d.ht')
+        journal = Journal(self.filename, resume=True)
+        journal.record('d.html', CONVERTED)
+        journal.close()
+        self.assertEqual(Journal(self.filename, resume=True).remaining(['a.html', 'd.html']), [],
+                         'A line cut off by a crash broke the journal.')
+
+
+class TestReviewQueue(unittest.TestCase):
+    """Test the queue of cases deferred for review."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'review.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def testQueue(self):
+        queue = ReviewQueue(self.filename)
+        queue.add('b.html', 'Not in the list.')
+        queue.add('a.html', 'Listed twice.')
+        queue.add('c.html', 'Not in the list.')
+        queue.remove('c.html')
+        queue = ReviewQueue(self.filename)
+        self.assertEqual(queue.files(), ['b.html', 'a.html'], 'Incorrect files waiting for review.')
+        self.assertEqual(queue.entries['a.html'], 'Listed twice.', 'Reason was not kept.')
+        self.assertNotIn('c.html', queue, 'Reviewed file was not removed from the queue.')
+
+    def testMissingFile(self):
+        self.assertEqual(ReviewQueue(self.filename).files(), [], 'Queue should start out empty.')
+
+
+if __name__ == '__main__':
+    unittest.main()
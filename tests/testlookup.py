@@ -0,0 +1,94 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+import time
+import unittest
+
+from api import API
+from bexceptions import *
+from lookup import lookup_cases
+from tests.localserver import LocalServer
+from tests.testapi import VOLUME
+
+
+class TestLookup(unittest.TestCase):
+    """Test looking up a batch of cases concurrently against a local stand-in for the API."""
+
+    volumes = ('970', '971', '972')
+
+    def setUp(self):
+        self.server = LocalServer(self.respond)
+        self.api = API(self.server.base_URL)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+
+    def tearDown(self):
+        self.server.close()
+        for volume in self.volumes:
+            for name in ('cache/' + volume, 'cache/' + volume + '.json'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def respond(self, query):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.05)
+        pages = dict()
+        for i, title in enumerate(query['titles'].split('|')):
+            if title.endswith('972') or 'Kibbe' in title:
+                pages[str(-i - 1)] = {'ns': 0, 'title': title, 'missing': ''}
+            elif 'rvprop' in query:
+                volume = title.split()[-1]
+                pages[str(i + 1)] = {'title': title, 'revisions': [
+                    {'revid': 100, '*': VOLUME.replace(' 1 U.S.', ' {0} U.S.'.format(volume))}]}
+            else:
+                pages[str(i + 1)] = {'title': title}
+        with self.lock:
+            self.running -= 1
+        return 200, {'query': {'pages': pages}}
+
+    def testResults(self):
+        results = lookup_cases(self.api, {'a': ('Bethel v. Lloyd', '970', '2'),
+                                          'b': ("Lessee of Pollard's Heirs v. Kibbe", '971', '120'),
+                                          'c': ('CaseName', '970', '800'),
+                                          'd': ('CaseName', '972', '1')})
+        self.assertIn('[[Bethel v. Lloyd]]', results['a'][0])
+        self.assertTrue(results['a'][1], 'Existing case was reported missing.')
+        self.assertIn('Kibbe', results['b'][0])
+        self.assertFalse(results['b'][1], 'Missing case was reported as existing.')
+        self.assertIsInstance(results['c'], NoCaseInList)
+        self.assertIsInstance(results['d'], PageNotFound)
+        self.assertEqual(len(self.server.requests), 2, 'Requests were not batched.')
+
+    def testConcurrency(self):
+        self.api.max_volumes = 1
+        lookup_cases(self.api, dict((volume, ('Bethel v. Lloyd', volume, '2'))
+                                    for volume in self.volumes), concurrency=2)
+        self.assertEqual(self.most_running, 2, 'Requests did not run concurrently, or ran past '
+                                               'the concurrency limit.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from manifest import Manifest, pipeline_version
+
+LINE = '* 1 U.S. 2 [[Bethel v. Lloyd]]'
+
+
+class TestManifest(unittest.TestCase):
+    """Test the record of converted cases used to skip unchanged ones."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'BethelvLloyd')
+        with open(self.output, 'w', encoding='utf-8') as output:
+            output.write('Converted')
+        self.filename = os.path.join(self.directory.name, 'manifest.json')
+        manifest = Manifest(self.filename)
+        manifest.record('case.html', Manifest.entry('abc', LINE, [self.output]))
+        manifest.save()
+        self.manifest = Manifest(self.filename)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def testCurrent(self):
+        self.assertTrue(self.manifest.is_current('case.html', 'abc', LINE, [self.output]),
+                        'Unchanged case was not recognized.')
+
+    def testChangedInput(self):
+        self.assertFalse(self.manifest.is_current('case.html', 'abd', LINE, [self.output]),
+                         'Changed input file was not noticed.')
+        self.assertFalse(self.manifest.is_current('other.html', 'abc', LINE, [self.output]),
+                         'File that was never converted was reported as current.')
+
+    def testChangedLine(self):
+        self.assertFalse(self.manifest.is_current('case.html', 'abc', LINE.replace('2', '3'),
+                                                  [self.output]),
+                         'Changed volume list entry was not noticed.')
+
+    def testChangedPipeline(self):
+        self.manifest.entries['case.html']['pipeline'] = 'old'
+        self.assertFalse(self.manifest.is_current('case.html', 'abc', LINE, [self.output]),
+                         'Change to the pipeline was not noticed.')
+        self.assertEqual(len(pipeline_version()), 40)
+
+    def testNewOutput(self):
+        wikitext = os.path.join(self.directory.name, 'wikitext')
+        with open(wikitext, 'w', encoding='utf-8') as output:
+            output.write('Converted')
+        self.assertFalse(self.manifest.is_current('case.html', 'abc', LINE, [self.output, wikitext]),
+                         'Output that was not written last time was not noticed.')
+
+    def testMissingOutput(self):
+        os.remove(self.output)
+        self.assertFalse(self.manifest.is_current('case.html', 'abc', LINE, [self.output]),
+                         'Deleted output was not noticed.')
+
+    def testUnreadable(self):
+        with open(self.filename, 'w', encoding='utf-8') as manifest_file:
+            manifest_file.write('{')
+        self.assertEqual(Manifest(self.filename).entries, {}, 'Broken manifest was not ignored.')
+
+
+if __name__ == '__main__':
+    unittest.main()
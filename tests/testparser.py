@@ -17,8 +17,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from caseparser import Parser
+from caseparser import Parser, strip_extraneous
 from bexceptions import *
+import io
 import unittest
 
 
@@ -60,6 +61,33 @@ class TestParser(unittest.TestCase):
         self.assertEqual(self.parser.smallcaps(content), "{{sc|Foo}}",
                          "Incorrect value returned from small caps parser.")
 
+    def testDispatch(self):
+        tokens = [['PARAGRAPH', ('', '')], ['ITALICS', '<i>'], ['WORD', 'Foo'], ['ITALICS', '</i>'],
+                  ['PUNCTUATION', "'"], ['WHITESPACE', '\t'], ['NUMBER', '12'], ['PARAGRAPH', ('/', '')]]
+        output = io.StringIO()
+        self.parser.parse(tokens, output)
+        self.assertEqual(output.getvalue(), "\n\n''Foo''¤ 12", 'Parser wrote incorrect wikitext.')
+
+    def testDispatchStopsOnError(self):
+        output = io.StringIO()
+        self.parser.parse([['WORD', 'Foo'], ['HTML_ENTITY', 'foo'], ['WORD', 'Bar']], output)
+        self.assertEqual(output.getvalue(), 'Foo', 'Parser continued after an unknown entity.')
+
+
+class TestStripExtraneous(unittest.TestCase):
+    """Test removing the extra HTML from a page."""
+
+    def testStrip(self):
+        page = ('<html><article class="x"></article><article\nid="maincontent">\n\t<h1>Foo</h1>\n'
+                '</article><div>footer</div></article></body></html>\nSource\t')
+        self.assertEqual(strip_extraneous(page), '<h1>Foo</h1>Source', 'Incorrect text kept.')
+
+    def testNoArticle(self):
+        self.assertIsNone(strip_extraneous('<h1>Foo v. Bar - 1 U.S. 2 (1790)</h1>'),
+                          'Returned text for a page with no article.')
+        self.assertIsNone(strip_extraneous('<article id="maincontent"><h1>Foo</h1></article>'),
+                          'Returned text for a page with no end.')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+from postprocessor import Postprocessor
+
+FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files')
+
+
+class TestPostprocessor(unittest.TestCase):
+    """Test postprocessor module."""
+
+    def tearDown(self):
+        try:
+            os.remove('buffer.txt')
+        except OSError:
+            pass
+
+    def testInMemory(self):
+        self.assertEqual(Postprocessor(None, "  Foo¤s\n \nbar\n").process(), "Foo's\n\nbar",
+                         'Postprocessor returned incorrect text.')
+        self.assertFalse(os.path.exists('buffer.txt'), 'Postprocessor wrote a file in memory mode.')
+
+    def testFile(self):
+        with open('buffer.txt', 'w', encoding='utf-8') as buffer:
+            buffer.write("Foo\nbar")
+        Postprocessor('buffer.txt').process()
+        with open('buffer.txt', encoding='utf-8') as buffer:
+            self.assertEqual(buffer.read(), "Foo\n\nbar", 'Postprocessor wrote incorrect text.')
+
+    def testMultilineBold(self):
+        postprocessor = Postprocessor(None, "'''Foo\n\nbar''' baz '''''' <nowiki>'''</nowiki>")
+        postprocessor.multiline_bold()
+        self.assertEqual(postprocessor.content, "'''Foo\n\nbar''' baz  <nowiki>'''</nowiki>",
+                         'Bold spans were not rebuilt correctly.')
+
+    def testUnclosedBold(self):
+        postprocessor = Postprocessor(None, "'''</nowiki>x" * 5000)
+        postprocessor.multiline_bold()
+        self.assertEqual(postprocessor.content, "'''</nowiki>x" * 5000,
+                         'Unclosed bold markup was changed.')
+
+    def testSinglePass(self):
+        # Expected output from the old postprocessor, which cleaned the line breaks, dropped empty
+        # bold spans, restored apostrophes and cleaned the line breaks again in separate passes.
+        self.assertEqual(Postprocessor(None, "a\n   |b").process(), "a\n\n |b",
+                         'Line break was not cleaned twice.')
+        self.assertEqual(Postprocessor(None, "a\n  \n  |b").process(), "a\n\n|b",
+                         'Runs joined by dropping a bold span were not cleaned together.')
+        self.assertEqual(Postprocessor(None, " \n:a\n").process(), ":a",
+                         'Whitespace left at the ends by dropping bold spans was not removed.')
+
+    def testMultilineItalic(self):
+        postprocessor = Postprocessor(None, "''Foo\n\nbar'' '''baz'''")
+        postprocessor.multiline_italic()
+        self.assertEqual(postprocessor.content, "''Foo''\n\n''bar'' '''baz'''",
+                         'Italics were not reopened after a paragraph break.')
+
+    def testGolden(self):
+        # The expected output was produced by the original multi-pass postprocessor.
+        with open(os.path.join(FILES, 'postprocessor_input.txt'), encoding='utf-8', newline='') as f:
+            content = f.read()
+        with open(os.path.join(FILES, 'postprocessor_expected.txt'), encoding='utf-8', newline='') as f:
+            expected = f.read()
+        self.assertEqual(Postprocessor(None, content).process(), expected,
+                         'Postprocessor output differs from the multi-pass output.')
+
+
+if __name__ == '__main__':
+    unittest.main()
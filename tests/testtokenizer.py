@@ -0,0 +1,73 @@
+# -*- coding: utf-8  -*-
+# Brandeis - A tool to convert plaintext court cases (from the lochner
+# tool: http://gitorious.org/lochner/) to wikitext.
+# 
+# Copyright (C) 2013 Molly White
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import unittest
+
+import ply.lex as lex
+from tokenizer import Tokenizer
+
+
+class TestTokenizer(unittest.TestCase):
+    """Test tokenizer module."""
+
+    def testTokens(self):
+        tokens = Tokenizer({}).analyze('<p>Foo, 1</p>')
+        self.assertEqual(tokens, [['PARAGRAPH', ('', '')], ['ABBR', 'F'], ['WORD', 'oo'],
+                                  ['PUNCTUATION', ','], ['WHITESPACE', ' '], ['NUMBER', '1'],
+                                  ['PARAGRAPH', ('/', '')]],
+                         'Tokenizer returned incorrect tokens.')
+
+    def testIterTokens(self):
+        tokens = Tokenizer({}).iter_tokens('<p>Foo, 1</p>')
+        self.assertEqual(next(tokens), ['PARAGRAPH', ('', '')], 'Generator gave an incorrect token.')
+        self.assertEqual(list(tokens), Tokenizer({}).analyze('<p>Foo, 1</p>')[1:],
+                         'Generator and analyze() gave different tokens.')
+
+    def testTokenSink(self):
+        sink = io.StringIO()
+        Tokenizer({}, sink).analyze('<p>Foo')
+        self.assertEqual(len(sink.getvalue().splitlines()), 3, 'Tokens were not written to the sink.')
+
+    def testSharedLexer(self):
+        first = Tokenizer({})
+        second = Tokenizer({})
+        self.assertIs(first.lexer.lexstatere, second.lexer.lexstatere,
+                      'Lexer rules were rebuilt for a second Tokenizer.')
+        self.assertIsNot(first.lexer, second.lexer, 'Tokenizers share lexer state.')
+
+    def testStateReset(self):
+        tokenizer = Tokenizer({})
+        tokenizer.analyze('<blockquote>')
+        self.assertEqual(tokenizer.analyze('<p>')[-1], ['PARAGRAPH', ('', '')],
+                         'Blockquote state leaked into the next document.')
+
+    def testLextab(self):
+        Tokenizer.build()
+        lextab = Tokenizer.read_lextab()
+        self.assertIsNotNone(lextab, 'No lexer table was saved for the current rules.')
+        lexer = lex.lex(module=Tokenizer, optimize=1, lextab=lextab)
+        tokenizer = Tokenizer({})
+        tokenizer.lexer = lexer
+        self.assertEqual(tokenizer.analyze('<blockquote><p>Foo</p>')[1], ['B_PARAGRAPH', ('', '')],
+                         'Lexer loaded from the saved table tokenized differently.')
+
+
+if __name__ == '__main__':
+    unittest.main()
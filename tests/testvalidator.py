@@ -22,6 +22,7 @@ import os
 import unittest
 
 from bexceptions import *
+from document import Document
 from validator import Validator
 
 
@@ -29,10 +30,11 @@ class TestFileValidation(unittest.TestCase):
     """Test functions that validate the input files."""
 
     def setUp(self):
-        pass
+        self.buffer = None
 
     def tearDown(self):
-        self.buffer.close()
+        if self.buffer:
+            self.buffer.close()
 
     def testGoodTitlePlacement(self):
         with open('buffer.txt', 'w', encoding='utf-8') as self.buffer:
@@ -91,6 +93,13 @@ class TestFileValidation(unittest.TestCase):
                                              'formatted case number.'):
             v.validate_title_parts()
 
+    def testDocument(self):
+        v = Validator('not_read.txt', Document('not_read.txt', '<h1>Foo v. Bar - 1 U.S. 2 (1790)</h1>'))
+        try:
+            v.validate()
+        except ValidatorError:
+            self.fail('Validator did not pass a good title from a document.')
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -17,11 +17,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import gzip
+import hashlib
+import importlib.util
 import logging
+import os
 
 import ply.lex as lex
 from bexceptions import IllegalCharacter
 
+# Precompiled lexer table, regenerated whenever the token rules change
+LEXTAB = 'tokenizer_lextab'
+LEXTAB_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 class Tokenizer(object):
     # ===================================================================================================
@@ -68,12 +76,67 @@ class Tokenizer(object):
         ('blockquote', 'inclusive'),
     )
 
-    def __init__(self, mdict):
-        """Initiate logging, open a file to store tokens, build the lexer."""
+    # The compiled lexer, shared by every Tokenizer in the process
+    master_lexer = None
+
+    def __init__(self, mdict, sink=None):
+        """Initiate logging, get a copy of the lexer. If a sink (any object with a write() method)
+        is given, every token is written to it for debugging."""
         self.token_list = list()
         self.logger = logging.getLogger('brandeis')
         self.metadict = mdict
-        self.lexer = lex.lex(module=self)
+        self.sink = sink
+        self.lexer = self.build().clone()
+
+    @classmethod
+    def build(cls):
+        """Build the lexer the first time it is needed. The token rules are all static, so the
+        rules are validated and compiled once per process and each Tokenizer works on a clone.
+        If a lexer table matching the current rules was saved by an earlier run, it is loaded
+        instead of reflecting over the class again."""
+        if cls.master_lexer is None:
+            lextab = cls.read_lextab()
+            if lextab:
+                cls.master_lexer = lex.lex(module=cls, optimize=1, lextab=lextab)
+            else:
+                cls.master_lexer = lex.lex(module=cls)
+                cls.write_lextab(cls.master_lexer)
+        return cls.master_lexer
+
+    @classmethod
+    def signature(cls):
+        """Hash of the token list, the states and every rule, used to tell whether a saved lexer
+        table is out of date."""
+        rules = [(name, getattr(cls, name).__doc__) for name in sorted(dir(cls)) if name[:2] == 't_']
+        text = repr((lex.__version__, cls.tokens, cls.states, rules))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def read_lextab(cls):
+        """Load the saved lexer table, or None if there is none or it does not match the rules."""
+        filename = os.path.join(LEXTAB_DIR, LEXTAB + '.py')
+        try:
+            spec = importlib.util.spec_from_file_location(LEXTAB, filename)
+            lextab = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(lextab)
+        except (OSError, IOError, SyntaxError):
+            return None
+        if getattr(lextab, '_rulesignature', None) != cls.signature():
+            return None
+        return lextab
+
+    @classmethod
+    def write_lextab(cls, lexer):
+        """Save the lexer table for the next run. The table is written under a temporary name and
+        then moved into place, so parallel workers never load a half-written table."""
+        temp = '{0}_{1}'.format(LEXTAB, os.getpid())
+        try:
+            lexer.writetab(temp, LEXTAB_DIR)
+            with open(os.path.join(LEXTAB_DIR, temp + '.py'), 'a') as tabfile:
+                tabfile.write('_rulesignature = %s\n' % repr(cls.signature()))
+            os.replace(os.path.join(LEXTAB_DIR, temp + '.py'), os.path.join(LEXTAB_DIR, LEXTAB + '.py'))
+        except (OSError, IOError) as e:
+            logging.getLogger('brandeis').debug("Unable to save the lexer table: " + repr(e))
 
     # ===============================================================================
     # TOKEN DEFINITIONS
@@ -243,15 +306,31 @@ class Tokenizer(object):
         raise IllegalCharacter(token.lexpos)
 
     def analyze(self, data):
-        """Read through the text file and tokenize."""
-        self.lexer.input(data)
-        with open('tokenout.txt', 'w+', encoding='utf-8') as tokenfile:
-            while True:
-                token = self.lexer.token()
-                # print(token)
-                if not token:
-                    break  # No more input
-                l_token = [token.type, token.value]
-                self.token_list.append(l_token)
-                tokenfile.write(str(token) + '\n')
+        """Read through the text file and tokenize. Returns the whole list of tokens."""
+        self.token_list.extend(self.iter_tokens(data))
         return self.token_list
+
+    def iter_tokens(self, data):
+        """Tokenize the text lazily, yielding one [type, value] token at a time so the whole token
+        stream never has to be held in memory."""
+        self.lexer.begin('INITIAL')
+        self.lexer.input(data)
+        while True:
+            token = self.lexer.token()
+            if not token:
+                break  # No more input
+            if self.sink:
+                self.sink.write(str(token) + '\n')
+            yield [token.type, token.value]
+
+
+def open_token_dump(name, compress=False):
+    """Open a buffered file in tokens/ to dump the token stream of a single case, optionally
+    gzip-compressed. Each case gets its own file, so parallel workers never collide."""
+    try:
+        os.mkdir('tokens')
+    except OSError:
+        pass
+    if compress:
+        return gzip.open('tokens/' + name + '.gz', 'wt', encoding='utf-8')
+    return open('tokens/' + name, 'w', encoding='utf-8', buffering=1 << 16)
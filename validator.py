@@ -19,21 +19,21 @@
 
 import re
 from bexceptions import BadTitle, GroupedCase
+from document import Document
 
 
 class Validator(object):
     """
-
+    Checks the title of a case file. The file is read only if no Document is given for it.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, document=None):
         self.filename = filename
-        self.file = open(filename, encoding='utf-8')
+        self.document = document or Document(filename)
+        self.first_line = self.document.title_line
+        self.title = re.match(r'[\s\t]*<h1>(?P<title>.*?)</h1>', self.first_line)
         self.e = None
 
-    def __del__(self):
-        self.file.close()
-
     def validate(self):
         """Run various validation functions to try to weed out any improperly-formatted
         files."""
@@ -46,14 +46,7 @@ class Validator(object):
     def validate_title_placement(self):
         """Check a file to make sure it has a properly-formatted title. The title should be in the
         first line of the HTML file that isn't whitespace."""
-        while True:
-            first_line = self.file.readline()
-            match = re.match(r'^[\n\s\t\r]+$', first_line, re.MULTILINE)
-            if not match:
-                break
-        self.file.seek(0, 0)  # Reset position in file
-        title = re.match(r'[\s\t]*<h1>(.*?)</h1>', first_line)
-        if not title:
+        if not self.title:
             raise BadTitle("Poorly placed title in {}.".format(self.filename))
 
     def validate_title_parts(self):
@@ -65,14 +58,8 @@ class Validator(object):
         The full format of the title is:
         Title - Number Date
         """
-        while True:
-            first_line = self.file.readline()
-            match = re.match(r'^[\n\s\t\r]+$', first_line, re.MULTILINE)
-            if not match:
-                break
-        self.file.seek(0, 0)  # Reset position in file
-        match = re.match(r'[\s\t]*<h1>(?P<title>.*?)</h1>', first_line)
-        title = match.group('title')
+        first_line = self.first_line
+        title = self.title.group('title')
         parts = re.match(r'(?P<full>(?P<title>.*?)\s-\s(?P<number>.*?)\s\((?P<date>\d{4})\))',
                          title)
         if not parts: